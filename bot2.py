@@ -1,24 +1,44 @@
+import asyncio
+import bisect
+import math
 import logging
 import os
-from telegram import Update, InputFile
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, CallbackContext
 from telegram.error import NetworkError, BadRequest
-import requests
+from telegram.helpers import escape_markdown
+import httpx
 import re
 import numpy as np
 from io import BytesIO
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage, PageBreak
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.lib.enums import TA_LEFT, TA_CENTER
-from collections import defaultdict
-import matplotlib.pyplot as plt
-from functools import lru_cache
+from collections import OrderedDict, deque
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from contextlib import asynccontextmanager
+import hashlib
 import json
+import pickle
+import random
+import sqlite3
+import sys
+import threading
 import time
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
 
 
 # ===== Config =====
@@ -26,6 +46,75 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'isi dengan token')
 GOOGLE_SCRIPT_URL = os.getenv('GOOGLE_SCRIPT_URL', "isi dengan script url")
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID', '')
 CURRENT_VERSION = "1.0"
+SHEET_TIMEZONE = timezone(timedelta(hours=7))  # zona tanggal di spreadsheet ("GMT+7" di code.gs)
+UPDATE_CHECK_URL = "https://api.github.com/repos/username/repo/releases/latest"
+
+# ===== HTTP Client Config =====
+# Timeout per endpoint (detik). Apps Script sering lambat saat cold start,
+# jadi baca/tulis diberi waktu lebih lama daripada probe koneksi.
+HTTP_READ_TIMEOUT = httpx.Timeout(float(os.getenv('HTTP_READ_TIMEOUT', '15')), connect=5.0)
+HTTP_WRITE_TIMEOUT = httpx.Timeout(float(os.getenv('HTTP_WRITE_TIMEOUT', '20')), connect=5.0)
+HTTP_PROBE_TIMEOUT = httpx.Timeout(5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+
+# ===== Backend Health Config =====
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '30'))  # detik antar probe Apps Script
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '3'))  # kegagalan beruntun sebelum circuit dibuka
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '30'))  # detik circuit terbuka sebelum request dicoba lagi
+
+# ===== Retry Config =====
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', '3'))  # percobaan maksimum per request (termasuk yang pertama)
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.5'))  # detik, dikali 2 setiap percobaan
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '8'))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))  # retry + hedge maksimum per request
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))  # kirim read duplikat setelah latency ini (0 = nonaktif)
+
+# ===== Ledger Cache Config =====
+LEDGER_CACHE_TTL = float(os.getenv('LEDGER_CACHE_TTL', '60'))  # data dianggap segar (detik)
+LEDGER_CACHE_STALE_TTL = float(os.getenv('LEDGER_CACHE_STALE_TTL', '900'))  # masih boleh disajikan sambil refresh
+LEDGER_CACHE_NEGATIVE_TTL = float(os.getenv('LEDGER_CACHE_NEGATIVE_TTL', '15'))  # jeda retry setelah fetch gagal
+LEDGER_WIRE_FORMAT = os.getenv('LEDGER_WIRE_FORMAT', 'columnar')  # "columnar" atau "json" (array objek)
+LEDGER_DB_PATH = os.getenv('LEDGER_DB_PATH', 'ledger.db')  # mirror SQLite lokal dari spreadsheet
+
+# ===== Write Queue Config =====
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '50'))  # baris maksimum per request doPost
+WRITE_BATCH_DELAY = float(os.getenv('WRITE_BATCH_DELAY', '1'))  # detik menunggu baris lain ikut dalam batch
+WRITE_RETRY_DELAY = float(os.getenv('WRITE_RETRY_DELAY', '10'))  # jeda sebelum batch yang gagal dikirim ulang
+WRITE_JOURNAL_PATH = os.getenv('WRITE_JOURNAL_PATH', 'journal.jsonl')  # jurnal catatan yang belum tersimpan
+
+# ===== Chart Config =====
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))  # jumlah proses render grafik (0 = thread)
+CHART_CACHE_BYTES = int(os.getenv('CHART_CACHE_BYTES', str(32 * 1024 * 1024)))  # budget cache PNG di memori
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR', '')  # folder cache PNG di disk (kosong = nonaktif)
+CHART_CACHE_DISK_BYTES = int(os.getenv('CHART_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+TELEGRAM_FILE_IDS_MAX = int(os.getenv('TELEGRAM_FILE_IDS_MAX', '500'))  # file_id upload yang diingat (terlama dibuang)
+
+# ===== PDF Report Config =====
+PDF_TABLE_CHUNK_ROWS = int(os.getenv('PDF_TABLE_CHUNK_ROWS', '250'))  # baris maksimum per tabel
+REPORT_SECTION_CACHE_ROWS = int(os.getenv('REPORT_SECTION_CACHE_ROWS', '20000'))  # baris tabel section bulanan yang di-cache
+TELEGRAM_DOCUMENT_LIMIT = int(os.getenv('TELEGRAM_DOCUMENT_LIMIT', str(50 * 1024 * 1024)))  # batas upload dokumen bot
+
+# ===== Info Config =====
+INFO_PAGE_SIZE = int(os.getenv('INFO_PAGE_SIZE', '10'))  # catatan per halaman /info
+
+# ===== Rate Limit Config =====
+RATE_LIMIT_CAPACITY = float(os.getenv('RATE_LIMIT_CAPACITY', '10'))  # token maksimum per user (burst)
+RATE_LIMIT_REFILL = float(os.getenv('RATE_LIMIT_REFILL', '0.5'))  # token per detik
+RATE_LIMIT_IDLE = float(os.getenv('RATE_LIMIT_IDLE', '600'))  # detik tanpa aktivitas sebelum bucket user dibuang
+HEAVY_RENDER_LIMIT = int(os.getenv('HEAVY_RENDER_LIMIT', '2'))  # grafik/PDF yang boleh dibuat bersamaan
+# Biaya token per jenis permintaan
+COMMAND_COSTS = {
+    "text": 1,
+    "info": 2,
+    "info_page": 1,
+    "cari": 2,
+    "budget": 1,
+    "range": 2,
+    "grafik": 3,
+    "kategori": 3,
+    "topkategori": 3,
+    "pdf": 8,
+}
 
 # ===== Logging Setup =====
 logging.basicConfig(
@@ -37,36 +126,1636 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # ===== Rate Limiting =====
-user_last_message = defaultdict(float)
-MESSAGE_COOLDOWN = 2  # detik
+class RateLimiter:
+    """
+    Per-user token buckets with idle eviction
 
-# ===== Helper Functions =====
-def check_internet() -> bool:
-    """Check internet connection"""
-    try:
-        requests.get('https://google.com', timeout=5)
+    Setiap user punya `capacity` token yang terisi `refill_rate` per detik; setiap
+    permintaan memakai token sesuai biayanya. Bucket yang tidak aktif selama `idle_ttl`
+    dibuang (saat itu sudah penuh lagi, jadi tidak ada informasi yang hilang).
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, idle_ttl: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.idle_ttl = max(idle_ttl, capacity / refill_rate)
+        self._buckets: OrderedDict = OrderedDict()  # user_id -> (tokens, updated_at), urutan aktivitas
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, user_id: int, cost: float) -> float:
+        """Take `cost` tokens; returns 0 if allowed, otherwise seconds until it would be"""
+        now = time.monotonic()
+        self._evict(now)
+        cost = min(cost, self.capacity)
+        tokens, updated_at = self._buckets.pop(user_id, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_rate)
+
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.refill_rate
+        self._buckets[user_id] = (tokens, now)
+        return wait
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            user_id, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_ttl:
+                break
+            del self._buckets[user_id]
+
+rate_limiter = RateLimiter(RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL, RATE_LIMIT_IDLE)
+heavy_renders = asyncio.Semaphore(HEAVY_RENDER_LIMIT)
+
+async def allow_request(update: Update, command: str) -> bool:
+    """Apply the user's rate limit for a command; replies and returns False when exceeded"""
+    wait = rate_limiter.acquire(update.effective_user.id, COMMAND_COSTS.get(command, 1))
+    if wait <= 0:
         return True
-    except:
+    await update.message.reply_text(f"⏳ Harap tunggu {math.ceil(wait)} detik sebelum mengirim pesan lagi")
+    return False
+
+@asynccontextmanager
+async def render_slot(update: Update):
+    """Limit how many charts/PDF reports are produced at the same time"""
+    if heavy_renders.locked():
+        await update.message.reply_text("⏳ Sedang membuat laporan lain, permintaan Anda diantrekan...")
+    async with heavy_renders:
+        yield
+
+# ===== HTTP Client =====
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared async HTTP client (created lazily, pooled with keep-alive)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=HTTP_LIMITS,
+            timeout=HTTP_READ_TIMEOUT,
+            # Apps Script web app selalu redirect ke googleusercontent.com
+            follow_redirects=True,
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+async def script_get(params: dict, timeout: httpx.Timeout = HTTP_READ_TIMEOUT) -> httpx.Response:
+    """GET request to the Apps Script endpoint"""
+    return await _script_request("GET", timeout, params=params)
+
+async def script_post(payload, timeout: httpx.Timeout = HTTP_WRITE_TIMEOUT) -> httpx.Response:
+    """POST JSON payload to the Apps Script endpoint"""
+    return await _script_request("POST", timeout, json=payload)
+
+async def _script_request(method: str, timeout: httpx.Timeout, **kwargs) -> httpx.Response:
+    """Send a request with retries (exponential backoff + jitter) and hedged reads"""
+    retry_budget.on_request()
+    attempt = 0
+    while True:
+        try:
+            if method == "GET":
+                return await _hedged_send(timeout, **kwargs)
+            # Write aman diulang: setiap baris membawa id yang di-dedupe oleh Apps Script
+            return await _send_once(method, timeout, **kwargs)
+        except httpx.HTTPError as e:
+            attempt += 1
+            if (isinstance(e, BackendUnavailable) or not is_backend_failure(e)
+                    or attempt >= RETRY_ATTEMPTS or not retry_budget.try_spend()):
+                raise
+            delay = retry_delay(attempt, e)
+            reason = str(e).splitlines()[0] if str(e) else type(e).__name__
+            logger.warning(f"Apps Script {method} failed ({reason}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def _send_once(method: str, timeout: httpx.Timeout, **kwargs) -> httpx.Response:
+    """Send one request through the circuit breaker and record its outcome"""
+    trial = backend_health.check()
+    started = time.monotonic()
+    try:
+        response = await get_http_client().request(method, GOOGLE_SCRIPT_URL, timeout=timeout, **kwargs)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if is_backend_failure(e):
+            backend_health.record_failure(e)
+        raise
+    finally:
+        if trial:
+            backend_health.end_trial()
+    latency = time.monotonic() - started
+    backend_health.record_success(latency)
+    if method == "GET":
+        read_latency.add(latency)
+    return response
+
+async def _hedged_send(timeout: httpx.Timeout, **kwargs) -> httpx.Response:
+    """
+    GET with an optional hedge: if no answer arrives within the latency percentile,
+    a duplicate request is sent and whichever succeeds first is used
+    """
+    delay = read_latency.hedge_delay()
+    primary = asyncio.ensure_future(_send_once("GET", timeout, **kwargs))
+    tasks = {primary}
+    try:
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not retry_budget.try_spend():
+            return await primary
+
+        logger.info(f"Apps Script read slower than {delay:.2f}s, sending hedged request")
+        tasks.add(asyncio.ensure_future(_send_once("GET", timeout, **kwargs)))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# ===== Retry Policy =====
+def retry_delay(attempt: int, error: httpx.HTTPError) -> float:
+    """Exponential backoff with full jitter; honours Retry-After on 429 responses"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = error.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = max(delay, min(RETRY_MAX_DELAY, float(retry_after)))
+    return delay
+
+class RetryBudget:
+    """
+    Token bucket that caps retries and hedges to a fraction of requests
+
+    Setiap request menambah `ratio` token; setiap retry/hedge memakai satu token.
+    Saat backend bermasalah, retry tidak melipatgandakan beban ke Apps Script.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def on_request(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
         return False
 
-@lru_cache(maxsize=1)
-def get_cached_data(force_refresh: bool = False) -> list:
-    """Get cached data with optional force refresh"""
-    if force_refresh:
-        get_cached_data.cache_clear()
+class LatencyTracker:
+    """Sliding window of recent successful read latencies"""
+
+    def __init__(self, percentile: float, size: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a read is hedged (None = not enough data or disabled)"""
+        if self.percentile <= 0 or len(self._samples) < self.min_samples:
+            return None
+        return float(np.percentile(self._samples, self.percentile))
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO)
+read_latency = LatencyTracker(HEDGE_PERCENTILE)
+
+# ===== Backend Health =====
+class BackendUnavailable(httpx.TransportError):
+    """Raised without touching the network while the circuit breaker is open"""
+
+def is_backend_failure(error: httpx.HTTPError) -> bool:
+    """Whether an error means the backend is unreachable or overloaded (not a bad request)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+class BackendHealth:
+    """
+    Reachability/latency tracker and circuit breaker for the Apps Script backend
+
+    - closed: request berjalan normal
+    - open: setelah `failure_threshold` kegagalan beruntun; request langsung gagal dengan
+      BackendUnavailable sehingga pemanggil menyajikan data cache tanpa menunggu timeout
+    - half-open: setelah `cooldown`, satu request percobaan diizinkan; sukses menutup circuit
+    Probe latar belakang (action=ping) memperbarui status tanpa menunggu request user.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.latency: Optional[float] = None  # rata-rata bergerak (EWMA) dalam detik
+        self.last_error = ""
+        self._opened_at: Optional[float] = None
+        self._trial = False  # request percobaan half-open sedang berjalan
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    @property
+    def available(self) -> bool:
+        """False while the backend is known to be down"""
+        return self.state == "closed"
+
+    def check(self) -> bool:
+        """
+        Fail fast if the circuit is open (or a half-open trial is already running)
+
+        Returns True if the caller's request became the half-open trial; it must then
+        call end_trial() when that request finishes, whatever the outcome.
+        """
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial):
+            raise BackendUnavailable(f"Apps Script tidak dapat dihubungi: {self.last_error}")
+        if state == "half-open":
+            self._trial = True
+            return True
+        return False
+
+    def end_trial(self) -> None:
+        # Trial yang berakhir 4xx atau dibatalkan tidak mencatat sukses/gagal; tanpa ini
+        # circuit tertahan di half-open dan menolak semua request berikutnya
+        self._trial = False
+
+    def record_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.failures = 0
+        self._trial = False
+        if self._opened_at is not None:
+            logger.info(f"Apps Script reachable again ({latency:.2f}s), closing circuit")
+            self._opened_at = None
+
+    def record_failure(self, error: Exception) -> None:
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        self._trial = False
+        if self._opened_at is not None or self.failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"Apps Script failed {self.failures} times in a row, opening circuit: {self.last_error}")
+            self._opened_at = time.monotonic()
+
+backend_health = BackendHealth(BREAKER_FAILURES, BREAKER_COOLDOWN)
+BACKEND_DOWN_MESSAGE = "⚠️ Server spreadsheet sedang tidak dapat dihubungi, silakan coba lagi nanti"
+
+async def probe_backend(context: CallbackContext) -> None:
+    """Background health check: ping the Apps Script and update the circuit breaker"""
+    started = time.monotonic()
     try:
-        response = requests.get(GOOGLE_SCRIPT_URL + "?action=getData", timeout=10)
+        response = await get_http_client().get(
+            GOOGLE_SCRIPT_URL, params={"action": "ping"}, timeout=HTTP_PROBE_TIMEOUT
+        )
         response.raise_for_status()
-        return response.json()
-    except:
-        return []
+    except httpx.HTTPError as e:
+        backend_health.record_failure(e)
+        logger.debug(f"Apps Script probe failed: {e}")
+        return
+    backend_health.record_success(time.monotonic() - started)
+    logger.debug(f"Apps Script probe ok, latency {backend_health.latency:.2f}s")
+
+# ===== Ledger Cache =====
+def parse_amount(value) -> int:
+    """Parse a nominal value (number or text such as "50.000") into an integer amount"""
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    raw = str(value).replace(".", "").replace(",", "").strip()
+    return int(raw) if raw.isdigit() else 0
+
+class Expense:
+    """
+    One ledger row, parsed once at ingestion
+
+    Attributes:
+        tanggal: Date text as stored in the sheet (dd-mm-YYYY)
+        ordinal: date.toordinal() of tanggal, 0 if the date is invalid
+        year, month: Calendar period of tanggal (0 if invalid)
+        amount: Nominal as integer rupiah
+        kategori: Category as entered (stripped), used for display
+        category: Normalized, interned category key
+        keterangan: Description
+    """
+    __slots__ = ("tanggal", "ordinal", "year", "month", "amount", "kategori", "category", "keterangan")
+
+    def __init__(self, tanggal: str, amount: int, kategori: str, keterangan: str, category: Optional[str] = None):
+        self.tanggal = tanggal
+        try:
+            day, month, year = map(int, tanggal.split('-'))
+            self.ordinal = date(year, month, day).toordinal()
+            self.year = year
+            self.month = month
+        except ValueError:
+            self.ordinal = 0
+            self.year = 0
+            self.month = 0
+        self.amount = amount
+        self.kategori = kategori
+        # category bisa diberikan oleh pemanggil yang sudah menormalisasi nama kategori
+        self.category = category if category is not None else sys.intern(normalize_category(kategori))
+        self.keterangan = keterangan
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Expense":
+        """Build a record from a getData row dict"""
+        return cls(
+            str(row.get("tanggal") or "").strip(),
+            parse_amount(row.get("nominal", "")),
+            str(row.get("kategori") or "Lainnya").strip(),
+            str(row.get("keterangan") if row.get("keterangan") is not None else "-"),
+        )
+
+    @classmethod
+    def from_db(cls, row: tuple) -> "Expense":
+        """Build a record from a LedgerStore row (already parsed, no re-validation)"""
+        record = cls.__new__(cls)
+        (record.tanggal, record.ordinal, record.year, record.month,
+         record.amount, record.kategori, category, record.keterangan) = row
+        record.category = sys.intern(category)
+        return record
+
+    def to_dict(self) -> dict:
+        """Convert back to the getData row format (used for backups)"""
+        return {"tanggal": self.tanggal, "nominal": self.amount, "kategori": self.kategori, "keterangan": self.keterangan}
+
+def parse_rows(rows: list) -> list:
+    """Convert raw getData rows into Expense records"""
+    return [Expense.from_row(row) for row in rows]
+
+def decode_rows(rows) -> list:
+    """
+    Decode rows from the getData payload into Expense records
+
+    Menerima format lama (array objek) maupun format kolom (format=columnar):
+    {"tanggal": [...], "nominal": [angka], "kategori": [indeks], "kategori_names": [...], "keterangan": [...]}
+    Format kolom langsung dijadikan Expense tanpa dict per baris; nama kategori
+    dinormalisasi sekali per nama unik, bukan per baris.
+    """
+    if isinstance(rows, list):
+        return parse_rows(rows)
+    if rows.get("format") != "columnar":
+        raise ValueError(f"Unknown ledger format: {rows.get('format')}")
+    names = [str(name or "Lainnya").strip() for name in rows["kategori_names"]]
+    categories = [sys.intern(normalize_category(name)) for name in names]
+    return [
+        Expense(
+            str(tanggal or "").strip(),
+            nominal if type(nominal) is int else parse_amount(nominal),  # Apps Script sudah mengirim angka
+            names[kategori],
+            str(keterangan) if keterangan is not None else "-",
+            categories[kategori],
+        )
+        for tanggal, nominal, kategori, keterangan in zip(
+            rows["tanggal"], rows["nominal"], rows["kategori"], rows["keterangan"]
+        )
+    ]
+
+class MonthRollup:
+    """Materialized aggregates of one (year, month): count, total, per-day and per-category totals"""
+    __slots__ = ("year", "month", "count", "total", "daily", "categories", "category_counts", "names")
+
+    def __init__(self, year: int, month: int):
+        self.year = year
+        self.month = month
+        self.count = 0
+        self.total = 0
+        self.daily: dict = {}  # date ordinal -> total (hanya nominal positif)
+        self.categories: dict = {}  # kategori ternormalisasi -> total
+        self.category_counts: dict = {}
+        self.names: dict = {}  # kategori ternormalisasi -> nama tampilan
+
+    def apply(self, record: "Expense", sign: int = 1) -> None:
+        """Add (sign=1) or remove (sign=-1) one record"""
+        amount = sign * record.amount
+        self.count += sign
+        self.total += amount
+        if record.amount > 0:
+            day_total = self.daily.get(record.ordinal, 0) + amount
+            if day_total:
+                self.daily[record.ordinal] = day_total
+            else:
+                self.daily.pop(record.ordinal, None)
+
+        key = record.category
+        remaining = self.category_counts.get(key, 0) + sign
+        if remaining > 0:
+            self.category_counts[key] = remaining
+            self.categories[key] = self.categories.get(key, 0) + amount
+            self.names.setdefault(key, record.kategori)
+        else:
+            self.category_counts.pop(key, None)
+            self.categories.pop(key, None)
+            self.names.pop(key, None)
+
+    def summary(self) -> dict:
+        """Summary in the same shape as the Apps Script summary action"""
+        return {
+            "month": self.month,
+            "year": self.year,
+            "count": self.count,
+            "total": self.total,
+            "daily": {date.fromordinal(o).strftime("%d-%m-%Y"): t for o, t in sorted(self.daily.items())},
+            "categories": {k: {"name": self.names[k], "total": t} for k, t in self.categories.items()},
+        }
+
+class LedgerRollups:
+    """Per-(year, month) MonthRollup map, updated incrementally as records arrive"""
+
+    def __init__(self):
+        self.months: dict = {}
+
+    def rebuild(self, records: list) -> None:
+        """Recompute every month from scratch (after a full resync)"""
+        self.months = {}
+        self.add_all(records)
+
+    def add_all(self, records: list, sign: int = 1) -> None:
+        for record in records:
+            self.apply(record, sign)
+
+    def apply(self, record: "Expense", sign: int = 1) -> None:
+        if not record.ordinal:
+            return
+        key = (record.year, record.month)
+        rollup = self.months.get(key)
+        if rollup is None:
+            rollup = self.months[key] = MonthRollup(record.year, record.month)
+        rollup.apply(record, sign)
+        if rollup.count <= 0:
+            del self.months[key]
+
+    def summary(self, year: int, month: int) -> dict:
+        """Monthly summary in O(categories); empty dict if the month has no data"""
+        rollup = self.months.get((year, month))
+        return rollup.summary() if rollup else {}
+
+# ===== Local Mirror (SQLite) =====
+class LedgerStore:
+    """
+    SQLite mirror of the spreadsheet
+
+    Tabel `expenses` menyimpan setiap baris sheet (kolom `row` = nomor baris data) beserta
+    hasil parsing Expense. `sync_state` menyimpan cursor/token delta sync sehingga setelah
+    restart bot langsung bisa menjawab dari data lokal dan hanya menarik baris baru dari
+    Apps Script. Mirror ini hanya snapshot untuk restart (dibaca utuh dengan ORDER BY row);
+    perintah dijawab dari rollup dan index di memori, jadi tabel tidak diberi index sekunder.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Dipakai dari event loop (baca) dan thread worker (tulis massal), dijaga dengan lock.
+        # Koneksi dibuka saat pertama dipakai, sehingga proses worker grafik (yang ikut
+        # meng-import modul ini) tidak pernah menyentuh file database.
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database and create the schema on first use (caller holds the lock)"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS expenses ("
+                    " row INTEGER PRIMARY KEY, tanggal TEXT, ordinal INTEGER, year INTEGER, month INTEGER,"
+                    " amount INTEGER, kategori TEXT, category TEXT, keterangan TEXT)"
+                )
+                # Index dari versi sebelumnya tidak pernah dipakai query dan hanya memperlambat insert
+                conn.execute("DROP INDEX IF EXISTS idx_expenses_ordinal")
+                conn.execute("DROP INDEX IF EXISTS idx_expenses_category")
+                conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS telegram_files (content_key TEXT PRIMARY KEY, file_id TEXT, used_at REAL)"
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(telegram_files)")}
+                if "used_at" not in columns:  # database dari versi sebelum pruning
+                    conn.execute("ALTER TABLE telegram_files ADD COLUMN used_at REAL DEFAULT 0")
+                conn.execute("CREATE TABLE IF NOT EXISTS budgets (category TEXT PRIMARY KEY, name TEXT, amount INTEGER)")
+            self._conn = conn
+        return self._conn
+
+    _COLUMNS = "tanggal, ordinal, year, month, amount, kategori, category, keterangan"
+
+    @staticmethod
+    def _to_row(row: int, r: "Expense") -> tuple:
+        return (row, r.tanggal, r.ordinal, r.year, r.month, r.amount, r.kategori, r.category, r.keterangan)
+
+    def _write(self, records: list, first_row: int, cursor: int, token: str, replace: bool) -> None:
+        with self._lock, self._connection() as conn:
+            if replace:
+                conn.execute("DELETE FROM expenses")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO expenses (row, {self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._to_row(first_row + i, r) for i, r in enumerate(records)),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                [("cursor", str(cursor)), ("token", token)],
+            )
+
+    async def replace_all(self, records: list, cursor: int, token: str) -> None:
+        """Replace the whole mirror (after a full resync)"""
+        await asyncio.to_thread(self._write, records, 1, cursor, token, True)
+
+    async def append(self, records: list, first_row: int, cursor: int, token: str) -> None:
+        """Append delta rows starting at sheet data row `first_row`"""
+        await asyncio.to_thread(self._write, records, first_row, cursor, token, False)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def load(self) -> tuple:
+        """Load (records, cursor, token) saved by the last sync"""
+        state = dict(self._query("SELECT key, value FROM sync_state"))
+        rows = self._query(f"SELECT {self._COLUMNS} FROM expenses ORDER BY row")
+        return [Expense.from_db(row) for row in rows], int(state.get("cursor", 0)), state.get("token", "")
+
+    def get_file_id(self, content_key: str) -> Optional[str]:
+        """Telegram file_id previously returned for an uploaded artifact"""
+        with self._lock, self._connection() as conn:
+            row = conn.execute(
+                "SELECT file_id FROM telegram_files WHERE content_key = ?", (content_key,)
+            ).fetchone()
+            if row:
+                # tandai baru dipakai untuk pruning
+                conn.execute(
+                    "UPDATE telegram_files SET used_at = ? WHERE content_key = ?", (time.time(), content_key)
+                )
+            return row[0] if row else None
+
+    def save_file_id(self, content_key: str, file_id: Optional[str], keep: int = 0) -> None:
+        """
+        Remember (or forget, with file_id=None) the file_id of an uploaded artifact
+
+        Dengan `keep` > 0 hanya `keep` entri yang paling baru dipakai yang disimpan: key berisi
+        hash isi file, jadi grafik/laporan dari data lama tidak akan pernah diminta lagi.
+        """
+        with self._lock, self._connection() as conn:
+            if file_id is None:
+                conn.execute("DELETE FROM telegram_files WHERE content_key = ?", (content_key,))
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO telegram_files (content_key, file_id, used_at) VALUES (?, ?, ?)",
+                (content_key, file_id, time.time()),
+            )
+            if keep > 0:
+                conn.execute(
+                    "DELETE FROM telegram_files WHERE content_key NOT IN"
+                    " (SELECT content_key FROM telegram_files ORDER BY used_at DESC LIMIT ?)",
+                    (keep,),
+                )
+
+    def load_budgets(self) -> dict:
+        """Monthly budgets as {normalized category: (display name, amount)}"""
+        rows = self._query("SELECT category, name, amount FROM budgets")
+        return {category: (name, amount) for category, name, amount in rows}
+
+    def save_budget(self, category: str, name: str, amount: Optional[int]) -> None:
+        """Set (or remove, with amount=None) the monthly budget of a category"""
+        with self._lock, self._connection() as conn:
+            if amount is None:
+                conn.execute("DELETE FROM budgets WHERE category = ?", (category,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO budgets (category, name, amount) VALUES (?, ?, ?)",
+                    (category, name, amount),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+ledger_store = LedgerStore(LEDGER_DB_PATH)
+
+class LedgerRows(list):
+    """
+    Snapshot of the ledger rows, tagged with the sync generation it belongs to
+
+    Dalam satu generasi baris hanya pernah ditambahkan di belakang, jadi turunan yang
+    dibangun dari snapshot (analytics, section laporan) memakai generasi milik snapshot
+    itu sendiri, bukan generasi LedgerSync yang mungkin sudah maju saat dibaca.
+    """
+    __slots__ = ("generation",)
+
+    def __init__(self, records=(), generation: int = 0):
+        super().__init__(records)
+        self.generation = generation
+
+    def extends(self, previous: "LedgerRows") -> bool:
+        """
+        Whether this snapshot is `previous` plus rows appended after it
+
+        Struktur turunan (analytics, DateIndex, SearchIndex) cukup memproses baris ke
+        len(previous) dan seterusnya; jika False (full resync) strukturnya dibangun ulang.
+        """
+        return self.generation == previous.generation and len(self) >= len(previous)
+
+class LedgerSync:
+    """
+    Local copy of the ledger (as Expense records) kept up to date with incremental (delta) sync
+
+    Bot mengirim `since` (jumlah baris yang sudah dimiliki) dan `token` (digest yang
+    dihitung Apps Script atas semua baris itu). Apps Script hanya mengirim baris baru;
+    jika cursor/token tidak cocok (baris mana pun diedit/dihapus di sheet) server
+    mengirim ulang semua baris (full=true).
+    """
+
+    def __init__(self, store: LedgerStore):
+        self.store = store
+        self.records = LedgerRows()
+        self.total = 0  # total nominal semua baris yang sudah tersinkron, diperbarui per delta
+        self.cursor = 0
+        self.token = ""
+        self.rollups = LedgerRollups()
+        self.generation = 0  # naik setiap full resync (isi bulan lama bisa berubah)
+        # Catatan yang baru ditulis bot tapi belum terlihat lewat sync: [[seq, Expense]]
+        # seq None = masih di antrean tulis (belum tersimpan di spreadsheet)
+        self._pending: list = []
+        self._write_seq = 0
+        # pull() melanjutkan dari cursor, jadi dua pull tidak boleh berjalan bersamaan
+        # (mis. fetch baru setelah invalidate saat fetch lama masih berjalan)
+        self._pull_lock = asyncio.Lock()
+
+    def restore(self) -> list:
+        """Load the local mirror saved by previous runs; returns the records"""
+        records, self.cursor, self.token = self.store.load()
+        self.records = LedgerRows(records, self.generation)
+        self.total = sum(record.amount for record in self.records)
+        self.rollups.rebuild(self.records)
+        logger.info(f"Local ledger mirror loaded: {len(self.records)} rows (cursor={self.cursor})")
+        return self.records
+
+    def record_write(self, record: "Expense", confirmed: bool = True) -> None:
+        """Apply a new expense to the rollups before the next sync sees it"""
+        self._pending.append([None, record])
+        self.rollups.apply(record)
+        if confirmed:
+            self.confirm_writes([record])
+
+    def confirm_writes(self, records: list) -> None:
+        """Mark queued expenses as saved in the spreadsheet (the next sync will include them)"""
+        confirmed = {id(record) for record in records}
+        for entry in self._pending:
+            if entry[0] is None and id(entry[1]) in confirmed:
+                self._write_seq += 1
+                entry[0] = self._write_seq
+
+    def _unsynced(self, synced_seq: int) -> list:
+        return [entry for entry in self._pending if entry[0] is None or entry[0] > synced_seq]
+
+    def _settle_pending(self, synced_seq: int) -> None:
+        """Remove pending writes that the sync now includes (they arrive again as synced rows)"""
+        settled = [record for seq, record in self._pending if seq is not None and seq <= synced_seq]
+        self.rollups.add_all(settled, sign=-1)
+        self._pending = self._unsynced(synced_seq)
+
+    async def pull(self) -> list:
+        """Fetch new rows from the Apps Script and merge them into the local copy"""
+        async with self._pull_lock:
+            # cursor/token dibaca ulang setelah lock: pull sebelumnya mungkin sudah memajukannya
+            return await self._pull()
+
+    def _unchanged(self, records: list) -> bool:
+        """Whether a full copy has exactly the rows already held locally"""
+        return len(records) == len(self.records) and all(
+            a.tanggal == b.tanggal and a.amount == b.amount and a.kategori == b.kategori and a.keterangan == b.keterangan
+            for a, b in zip(records, self.records)
+        )
+
+    async def _pull(self) -> list:
+        # Semua write yang sudah selesai sebelum request ini pasti ikut terbaca oleh sync
+        synced_seq = self._write_seq
+        since = self.cursor
+        params = {"action": "getData", "since": since, "token": self.token}
+        if LEDGER_WIRE_FORMAT == "columnar":
+            params["format"] = "columnar"
+        response = await script_get(params)
+        payload = response.json()
+
+        if isinstance(payload, list):
+            # Apps Script versi lama belum mendukung delta sync
+            self._replace_records(parse_rows(payload), synced_seq)
+            self.cursor = len(payload)
+            self.token = ""
+            try:
+                await self.store.replace_all(self.records, self.cursor, self.token)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to update local ledger mirror: {e}")
+            return self.records
+
+        records = decode_rows(payload.get("rows", []))
+        first_row = len(self.records) + 1
+        # since=0 selalu berisi semua baris, walau server tidak menandainya full
+        full = bool(payload.get("full")) or since == 0
+        if full and self._unchanged(records):
+            # Mis. edit yang sudah dikembalikan: list, index dan section laporan tetap dipakai
+            full = False
+            records = []
+            self._settle_pending(synced_seq)
+        elif full:
+            logger.info(f"Ledger full resync: {len(records)} rows")
+            self._replace_records(records, synced_seq)
+        else:
+            self._settle_pending(synced_seq)
+            if records:
+                # List baru (bukan extend) agar pembaca yang memegang list lama tidak ikut berubah
+                extended = LedgerRows(self.records, self.generation)
+                extended.extend(records)
+                self.records = extended
+                self.total += sum(record.amount for record in records)
+                self.rollups.add_all(records)
+        cursor, token = self.cursor, self.token
+        self.cursor = int(payload.get("cursor", len(self.records)))
+        self.token = payload.get("token", "")
+
+        try:
+            if full:
+                await self.store.replace_all(self.records, self.cursor, self.token)
+            elif records or (self.cursor, self.token) != (cursor, token):
+                await self.store.append(records, first_row, self.cursor, self.token)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update local ledger mirror: {e}")
+        return self.records
+
+    def _replace_records(self, records: list, synced_seq: int) -> None:
+        """Replace every row (full resync) under a new generation and rebuild the rollups"""
+        self.generation += 1
+        self.records = LedgerRows(records, self.generation)
+        self.total = sum(record.amount for record in records)
+        self.rollups.rebuild(self.records)
+        self._pending = self._unsynced(synced_seq)
+        self.rollups.add_all([record for _, record in self._pending])
+
+ledger_sync = LedgerSync(ledger_store)
+
+async def fetch_ledger() -> list:
+    """Sync the ledger from the Apps Script (delta since the last known row)"""
+    return await ledger_sync.pull()
+
+class LedgerCache:
+    """
+    TTL cache for the ledger with stale-while-revalidate
+
+    - umur < ttl: data disajikan langsung
+    - ttl <= umur < stale_ttl: data lama disajikan, refresh jalan di background
+    - umur >= stale_ttl atau setelah invalidate(): fetch ulang sebelum menjawab
+    Fetch yang gagal tidak di-cache selamanya; retry diizinkan lagi setelah negative_ttl.
+    Pembaca yang datang bersamaan menunggu satu fetch yang sama (single-flight).
+    """
+
+    def __init__(self, fetcher, ttl: float, stale_ttl: float, negative_ttl: float, empty=None):
+        self._fetcher = fetcher
+        self._empty = [] if empty is None else empty
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._data: Optional[list] = None
+        self._fetched_at = 0.0
+        self._failed_at: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._generation = 0
+
+    def seed(self, data) -> None:
+        """Preload data (e.g. from the local mirror) as stale so the next read revalidates in background"""
+        self._data = data
+        self._fetched_at = time.monotonic() - self.ttl
+
+    @property
+    def loaded(self) -> bool:
+        """Whether data has been fetched successfully at least once"""
+        return self._data is not None
+
+    def invalidate(self) -> None:
+        """Mark cached data as expired (called after a successful write)"""
+        self._fetched_at = float('-inf')
+        self._failed_at = None
+        # Fetch yang sedang berjalan dimulai sebelum write, jangan dipakai bersama lagi
+        self._generation += 1
+        self._inflight = None
+
+    async def get(self, force_refresh: bool = False) -> list:
+        """Get the ledger, refreshing according to the cache policy"""
+        now = time.monotonic()
+        if self._failed_at is not None and now - self._failed_at < self.negative_ttl and not force_refresh:
+            return self._data if self._data is not None else self._empty
+        if self._data is None or force_refresh:
+            return await self._refresh()
+
+        age = now - self._fetched_at
+        if age < self.ttl:
+            return self._data
+        if age < self.stale_ttl:
+            self._schedule_refresh()
+            return self._data
+        return await self._refresh()
+
+    def _schedule_refresh(self) -> None:
+        if self._inflight is None:
+            self._start_fetch()
+
+    def _start_fetch(self) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(self._generation))
+        self._inflight = task
+        return task
+
+    async def _refresh(self) -> list:
+        """Refresh the ledger; concurrent callers share a single in-flight fetch"""
+        task = self._inflight or self._start_fetch()
+        # shield: pembatalan satu handler tidak boleh membatalkan fetch milik handler lain
+        return await asyncio.shield(task)
+
+    async def _fetch(self, generation: int) -> list:
+        try:
+            data = await self._fetcher()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Ledger fetch failed: {e}")
+            if generation == self._generation:
+                self._failed_at = time.monotonic()
+            return self._data if self._data is not None else self._empty
+        finally:
+            if generation == self._generation:
+                self._inflight = None
+        if generation == self._generation:
+            self._data = data
+            self._fetched_at = time.monotonic()
+            self._failed_at = None
+        return data
+
+ledger_cache = LedgerCache(
+    fetch_ledger, LEDGER_CACHE_TTL, LEDGER_CACHE_STALE_TTL, LEDGER_CACHE_NEGATIVE_TTL, empty=LedgerRows()
+)
+
+async def get_cached_data(force_refresh: bool = False) -> list:
+    """Get cached ledger (list of Expense) with optional force refresh"""
+    return await ledger_cache.get(force_refresh=force_refresh)
+
+async def load_local_ledger(app: Application) -> None:
+    """Serve the SQLite mirror immediately on startup; Apps Script only sends rows added since (all rows if older ones changed)"""
+    try:
+        records = ledger_sync.restore()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to load local ledger mirror: {e}")
+        return
+    if ledger_sync.cursor:
+        ledger_cache.seed(records)
+
+# ===== Analytics Engine =====
+def period_key(year: int, month: int) -> int:
+    """Encode (year, month) as a single sortable integer"""
+    return year * 12 + (month - 1)
+
+class LedgerAnalytics:
+    """
+    Columnar NumPy view of the ledger for vectorized rollups
+
+    Baris diurutkan (stable) per periode sehingga satu bulan adalah potongan kontigu
+    yang dicari dengan searchsorted. Agregasi per hari/kategori/bulan memakai np.bincount,
+    top-N memakai argsort. Objek tidak pernah diubah setelah dibuat; versi ledger berikutnya
+    yang hanya menambah baris dibangun dari versi sebelumnya (lihat `base`), sehingga
+    loop Python hanya menyentuh baris baru.
+    """
+
+    def __init__(self, records: LedgerRows, base: Optional["LedgerAnalytics"] = None):
+        self.records = records
+        self.generation = records.generation
+        start = len(base.records) if base is not None else 0
+        added = records[start:]
+        n = len(added)
+        ordinals = np.fromiter((r.ordinal for r in added), dtype=np.int64, count=n)
+        amounts = np.fromiter((r.amount for r in added), dtype=np.int64, count=n)
+        periods = np.fromiter((period_key(r.year, r.month) if r.ordinal else -1 for r in added),
+                              dtype=np.int64, count=n)
+
+        self.category_keys: list = list(base.category_keys) if base is not None else []
+        self.category_names: list = list(base.category_names) if base is not None else []
+        self._codes_by_key: dict = dict(base._codes_by_key) if base is not None else {}
+        codes = np.empty(n, dtype=np.int64)
+        for i, r in enumerate(added):
+            code = self._codes_by_key.get(r.category)
+            if code is None:
+                code = self._codes_by_key[r.category] = len(self.category_keys)
+                self.category_keys.append(r.category)
+                self.category_names.append(r.kategori)
+            codes[i] = code
+
+        # Baris dengan tanggal tidak valid (periode -1) ikut terurut di depan dan tidak pernah dipilih
+        order = np.argsort(periods, kind="stable")
+        if base is None:
+            self.order = order
+            self.periods = periods[order]
+            self.ordinals = ordinals[order]
+            self.amounts = amounts[order]
+            self.codes = codes[order]
+        else:
+            # Baris baru disisipkan di belakang baris lama dengan periode yang sama,
+            # jadi urutan sheet dalam satu bulan tetap terjaga tanpa mengurutkan ulang semuanya
+            positions = np.searchsorted(base.periods, periods[order], side="right")
+            self.order = np.insert(base.order, positions, order + start)
+            self.periods = np.insert(base.periods, positions, periods[order])
+            self.ordinals = np.insert(base.ordinals, positions, ordinals[order])
+            self.amounts = np.insert(base.amounts, positions, amounts[order])
+            self.codes = np.insert(base.codes, positions, codes[order])
+
+    def _month_slice(self, year: int, month: int) -> slice:
+        key = period_key(year, month)
+        lo = int(np.searchsorted(self.periods, key, side="left"))
+        hi = int(np.searchsorted(self.periods, key, side="right"))
+        return slice(lo, hi)
+
+    def month_records(self, year: int, month: int) -> list:
+        """Records of one calendar month, in sheet order (the period sort is stable)"""
+        sl = self._month_slice(year, month)
+        return [self.records[i] for i in self.order[sl]]
+
+    def month_version(self, year: int, month: int) -> tuple:
+        """(count, total) of a month; changes whenever rows are added to that month"""
+        sl = self._month_slice(year, month)
+        return sl.stop - sl.start, int(self.amounts[sl].sum())
+
+    def daily_totals(self, year: int, month: int) -> dict:
+        """Positive spending per day as {date ordinal: total}"""
+        sl = self._month_slice(year, month)
+        ordinals = self.ordinals[sl]
+        amounts = self.amounts[sl]
+        positive = amounts > 0
+        if not positive.any():
+            return {}
+        start = date(year, month, 1).toordinal()
+        totals = np.bincount(ordinals[positive] - start, weights=amounts[positive])
+        days = np.flatnonzero(totals)
+        return {int(start + d): int(totals[d]) for d in days}
+
+    def category_totals(self, year: int, month: int) -> dict:
+        """Spending per normalized category as {category: total}"""
+        sl = self._month_slice(year, month)
+        codes = self.codes[sl]
+        if not len(codes):
+            return {}
+        totals = np.bincount(codes, weights=self.amounts[sl], minlength=len(self.category_keys))
+        present = np.unique(codes)
+        return {self.category_keys[c]: int(totals[c]) for c in present}
+
+    def top_categories(self, year: int, month: int, n: int = 5) -> list:
+        """Top-n categories of a month as [(category, total)], largest first"""
+        totals = self.category_totals(year, month)
+        if not totals:
+            return []
+        keys = list(totals)
+        values = np.fromiter(totals.values(), dtype=np.int64, count=len(keys))
+        top = np.argsort(-values, kind="stable")[:n]
+        return [(keys[i], int(values[i])) for i in top]
+
+    def monthly_totals(self, start: Optional[tuple] = None, end: Optional[tuple] = None) -> dict:
+        """Total spending per month as {(year, month): total}, optionally only months in [start, end]"""
+        # Periode -1 (tanggal tidak valid) ada di depan dan selalu terlewati oleh batas bawah 0
+        lo = int(np.searchsorted(self.periods, period_key(*start) if start else 0, side="left"))
+        hi = len(self.periods) if end is None else int(np.searchsorted(self.periods, period_key(*end), side="right"))
+        if lo >= hi:
+            return {}
+        keys, inverse = np.unique(self.periods[lo:hi], return_inverse=True)
+        totals = np.bincount(inverse, weights=self.amounts[lo:hi])
+        return {(int(k) // 12, int(k) % 12 + 1): int(t) for k, t in zip(keys, totals)}
+
+    def category_name(self, category: str) -> str:
+        """Display name (first spelling seen) of a normalized category"""
+        return self.category_names[self._codes_by_key[category]]
+
+_analytics: Optional[LedgerAnalytics] = None
+
+def get_analytics(records: LedgerRows) -> LedgerAnalytics:
+    """Get the analytics engine for a ledger snapshot (extended with new rows, rebuilt after a full resync)"""
+    global _analytics
+    if _analytics is None:
+        _analytics = LedgerAnalytics(records)
+    elif _analytics.records is not records:
+        _analytics = LedgerAnalytics(records, _analytics if records.extends(_analytics.records) else None)
+    return _analytics
+
+class DateIndex:
+    """
+    Per-day totals with prefix sums for date range queries (/range)
+
+    Baris dikumpulkan per hari, keseluruhan dan per kategori; prefix sum disusun dari total
+    harian sehingga ukurannya sebanding jumlah hari, bukan jumlah baris. Prefix sum yang
+    terdampak baris baru disusun ulang saat query berikutnya.
+    Total rentang [a, b] = cumsum[hi] - cumsum[lo] dengan lo/hi dari searchsorted.
+    """
+
+    def __init__(self):
+        self.records = LedgerRows()
+        self.days: dict = {}  # date ordinal -> [jumlah baris, total]
+        self.categories: dict = {}  # kategori ternormalisasi -> {date ordinal: total}
+        self.names: dict = {}  # kategori ternormalisasi -> nama tampilan (ejaan pertama)
+        self._prefix: Optional[tuple] = None
+        self._category_prefix: dict = {}
+
+    def update(self, records: LedgerRows) -> None:
+        """Add rows appended since the last call (or rebuild if the ledger was replaced)"""
+        if records is self.records:
+            return
+        size = len(self.records)
+        appended = records.extends(self.records)
+        if not appended:
+            self.days = {}
+            self.categories = {}
+            self.names = {}
+            self._category_prefix = {}
+            size = 0
+        for position in range(size, len(records)):
+            record = records[position]
+            self.names.setdefault(record.category, record.kategori)
+            if not record.ordinal:
+                continue
+            day = self.days.get(record.ordinal)
+            if day is None:
+                day = self.days[record.ordinal] = [0, 0]
+            day[0] += 1
+            day[1] += record.amount
+            per_day = self.categories.setdefault(record.category, {})
+            per_day[record.ordinal] = per_day.get(record.ordinal, 0) + record.amount
+            self._category_prefix.pop(record.category, None)
+        if len(records) > size or not appended:
+            self._prefix = None
+        self.records = records
+
+    @staticmethod
+    def _bounds(ordinals: np.ndarray, start: int, end: int) -> tuple:
+        return (int(np.searchsorted(ordinals, start, side="left")),
+                int(np.searchsorted(ordinals, end, side="right")))
+
+    def range_total(self, start: int, end: int) -> tuple:
+        """(count, total) of rows dated between two ordinals (inclusive)"""
+        if self._prefix is None:
+            ordinals = np.array(sorted(self.days), dtype=np.int64)
+            stats = np.array([self.days[o] for o in ordinals.tolist()], dtype=np.int64).reshape(-1, 2)
+            self._prefix = (ordinals, np.vstack(([0, 0], np.cumsum(stats, axis=0))))
+        ordinals, cumsum = self._prefix
+        lo, hi = self._bounds(ordinals, start, end)
+        count, total = cumsum[hi] - cumsum[lo]
+        return int(count), int(total)
+
+    def range_categories(self, start: int, end: int) -> dict:
+        """Spending per normalized category between two ordinals (inclusive)"""
+        totals = {}
+        for category, per_day in self.categories.items():
+            prefix = self._category_prefix.get(category)
+            if prefix is None:
+                ordinals = np.array(sorted(per_day), dtype=np.int64)
+                amounts = np.array([per_day[o] for o in ordinals.tolist()], dtype=np.int64)
+                prefix = self._category_prefix[category] = (ordinals, np.concatenate(([0], np.cumsum(amounts))))
+            ordinals, cumsum = prefix
+            lo, hi = self._bounds(ordinals, start, end)
+            if hi > lo:
+                totals[category] = int(cumsum[hi] - cumsum[lo])
+        return totals
+
+    def category_name(self, category: str) -> str:
+        """Display name (first spelling seen) of a normalized category"""
+        return self.names[category]
+
+date_index = DateIndex()
+
+# ===== Budgets =====
+BUDGET_THRESHOLDS = (0.8, 1.0)  # peringatan saat pengeluaran kategori melewati 80% dan 100% budget
+
+class BudgetBook:
+    """
+    Monthly budget per normalized category
+
+    Pemakaian dibaca dari rollup bulanan (total per kategori yang diperbarui setiap write),
+    sehingga pengecekan setelah setiap catatan baru O(1) tanpa mengambil ulang sheet.
+    """
+
+    def __init__(self, store: LedgerStore):
+        self.store = store
+        self.budgets: dict = {}  # kategori ternormalisasi -> (nama, nominal)
+
+    async def load(self) -> None:
+        self.budgets = await asyncio.to_thread(self.store.load_budgets)
+
+    async def set(self, kategori: str, amount: int) -> None:
+        """Set the monthly budget of a category; amount 0 removes it"""
+        category = normalize_category(kategori)
+        name = kategori.strip() or "Lainnya"
+        await asyncio.to_thread(self.store.save_budget, category, name, amount or None)
+        if amount:
+            self.budgets[category] = (name, amount)
+        else:
+            self.budgets.pop(category, None)
+
+    @staticmethod
+    def spent(category: str, year: int, month: int) -> int:
+        """Spending of a category in a month, from the running rollups"""
+        rollup = ledger_sync.rollups.months.get((year, month))
+        return rollup.categories.get(category, 0) if rollup else 0
+
+    def check(self, record: "Expense") -> Optional[str]:
+        """Warning if this (already applied) expense pushed its category across a budget threshold"""
+        budget = self.budgets.get(record.category)
+        if budget is None or record.amount <= 0 or not ledger_cache.loaded:
+            return None  # tanpa ledger lengkap, total kategori bulan ini belum bisa dipercaya
+        name, limit = budget
+        after = self.spent(record.category, record.year, record.month)
+        before = after - record.amount
+        crossed = [t for t in BUDGET_THRESHOLDS if before < t * limit <= after]
+        if not crossed:
+            return None
+
+        percent = after * 100 // limit
+        if crossed[-1] >= 1:
+            return f"🚨 Budget {name} bulan ini terlampaui: {format_rupiah(after)} dari {format_rupiah(limit)} ({percent}%)"
+        return f"⚠️ Pengeluaran {name} bulan ini sudah {percent}% dari budget ({format_rupiah(after)} dari {format_rupiah(limit)})"
+
+budget_book = BudgetBook(ledger_store)
+
+# ===== Search Index =====
+def tokenize(text: str) -> set:
+    """Case-folded word tokens of a text"""
+    return set(re.findall(r"\w+", (text or "").casefold()))
+
+class SearchIndex:
+    """
+    Inverted index over keterangan and kategori
+
+    `postings` memetakan token -> posisi baris di ledger (urut naik), `vocabulary` adalah
+    daftar token terurut untuk prefix matching dengan bisect.
+    """
+
+    MIN_PREFIX = 2
+
+    def __init__(self):
+        self.records = LedgerRows()
+        self.postings: dict = {}
+        self.vocabulary: list = []
+
+    def update(self, records: LedgerRows) -> None:
+        """Index rows added since the last call (or rebuild if the ledger was replaced)"""
+        if records is self.records:
+            return
+        size = len(self.records)
+        appended = records.extends(self.records)
+        if not appended:
+            self.postings = {}
+            self.vocabulary = []
+            size = 0
+        for position in range(size, len(records)):
+            record = records[position]
+            for token in tokenize(record.keterangan) | tokenize(record.kategori):
+                positions = self.postings.get(token)
+                if positions is None:
+                    positions = self.postings[token] = []
+                    bisect.insort(self.vocabulary, token)
+                positions.append(position)
+        self.records = records
+
+    def _prefix_postings(self, prefix: str) -> list:
+        """Posting lists of every token starting with `prefix`"""
+        lo = bisect.bisect_left(self.vocabulary, prefix)
+        hi = lo
+        while hi < len(self.vocabulary) and self.vocabulary[hi].startswith(prefix):
+            hi += 1
+        return [self.postings[token] for token in self.vocabulary[lo:hi]]
+
+    def search(self, query: str) -> list:
+        """Row positions matching every query word (as a word prefix), newest first"""
+        terms = tokenize(query)
+        if not terms or any(len(term) < self.MIN_PREFIX for term in terms):
+            return []
+        # Irisan dimulai dari term dengan posting paling sedikit
+        candidates = sorted((self._prefix_postings(term) for term in terms),
+                            key=lambda lists: sum(map(len, lists)))
+        if len(candidates) == 1 and len(candidates[0]) == 1:
+            return candidates[0][0][::-1]  # satu token: posting list sudah terurut
+
+        result = None
+        for lists in candidates:
+            matches = set().union(*lists)
+            result = matches if result is None else result & matches
+            if not result:
+                return []
+        return sorted(result, reverse=True)
+
+search_index = SearchIndex()
+
+# ===== Monthly Summary =====
+_summary_caches: dict = {}
+
+async def fetch_month_summary(year: int, month: int) -> dict:
+    """Fetch per-day and per-category totals for one month from the Apps Script"""
+    response = await script_get({"action": "summary", "month": month, "year": year})
+    return response.json()
+
+async def get_month_summary(year: int, month: int) -> dict:
+    """
+    Get the cached monthly summary
+
+    Jika ledger sudah tersalin lokal (delta sync), ringkasan dibaca dari rollup bulanan yang
+    diperbarui inkremental (O(kategori));
+    jika belum, ringkasan diambil dari action=summary agar tidak perlu mengunduh seluruh sheet.
+
+    Returns:
+        dict: {"count", "total", "daily": {tanggal: total}, "categories": {normalized: {"name", "total"}}}
+    """
+    if ledger_cache.loaded:
+        await get_cached_data()
+        return ledger_sync.rollups.summary(year, month)
+
+    cache = _summary_caches.get((year, month))
+    if cache is None:
+        cache = LedgerCache(
+            lambda: fetch_month_summary(year, month),
+            LEDGER_CACHE_TTL, LEDGER_CACHE_STALE_TTL, LEDGER_CACHE_NEGATIVE_TTL, empty={}
+        )
+        _summary_caches[(year, month)] = cache
+    return await cache.get()
+
+async def get_period_summary(period: "Period") -> dict:
+    """
+    Summary of every month in a period, merged into the shape of get_month_summary
+
+    Hanya bulan di dalam periode yang diambil (paralel) dan dijumlahkan.
+    Returns {} jika tidak ada ringkasan bulan yang berhasil diambil.
+    """
+    summaries = await asyncio.gather(*(get_month_summary(year, month) for year, month in period.months()))
+    if not any(summaries):
+        return {}
+
+    merged = {"count": 0, "total": 0, "daily": {}, "categories": {}}
+    for summary in summaries:
+        if not summary:
+            continue
+        merged["count"] += summary.get("count", 0)
+        merged["total"] += summary.get("total", 0)
+        merged["daily"].update(summary.get("daily", {}))  # tanggal tidak pernah bertumpuk antar bulan
+        for key, item in summary.get("categories", {}).items():
+            entry = merged["categories"].setdefault(key, {"name": item["name"], "total": 0})
+            entry["total"] += item["total"]
+    return merged
+
+def invalidate_ledger() -> None:
+    """Expire the ledger and every monthly summary (called after a successful write)"""
+    ledger_cache.invalidate()
+    for cache in _summary_caches.values():
+        cache.invalidate()
+
+# ===== Write Queue =====
+class WriteJournal:
+    """
+    Append-only journal of accepted expenses (JSON lines, fsync'd before the user gets a reply)
+
+    Setiap catatan ditulis sebagai {"op": "add", "row": payload}; setelah spreadsheet
+    menerimanya ditambahkan {"op": "ack", "ids": [...]}. Saat start, entri yang belum
+    di-ack dikirim ulang. Baris terakhir yang terpotong (crash saat menulis) diabaikan.
+    """
+
+    COMPACT_AFTER = 1000  # ack sebelum jurnal ditulis ulang
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        self._unacked: dict = {}  # id -> payload, urutan sesuai penulisan
+        self._acked = 0
+
+    def _append(self, entry: dict) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rewrite(self) -> None:
+        """Atomically replace the journal with only the unacknowledged entries"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for payload in self._unacked.values():
+                f.write(json.dumps({"op": "add", "row": payload}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # tidak semua platform mendukung fsync direktori
+        self._acked = 0
+
+    def load(self) -> list:
+        """Read the journal left by previous runs; returns unacknowledged payloads in order"""
+        unacked = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning("Ignoring damaged line in write journal")
+                        continue
+                    if entry.get("op") == "add":
+                        unacked[entry["row"]["id"]] = entry["row"]
+                    elif entry.get("op") == "ack":
+                        for write_id in entry.get("ids", []):
+                            unacked.pop(write_id, None)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._unacked = unacked
+            self._rewrite()
+        return list(unacked.values())
+
+    def add(self, payload: dict) -> None:
+        with self._lock:
+            self._append({"op": "add", "row": payload})
+            self._unacked[payload["id"]] = payload
+
+    def ack(self, ids: list) -> None:
+        with self._lock:
+            self._append({"op": "ack", "ids": ids})
+            for write_id in ids:
+                self._unacked.pop(write_id, None)
+            self._acked += len(ids)
+            if not self._unacked or self._acked >= self.COMPACT_AFTER:
+                self._rewrite()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class WriteNotConfirmed(httpx.HTTPError):
+    """
+    Raised when doPost answers without confirming every row of a batch
+
+    Apps Script yang error (mis. timeout lock) tetap menjawab HTTP 200 berisi halaman
+    HTML, jadi status saja tidak cukup. `permanent` berarti deployment belum mendukung
+    mode batch: mengirim ulang hanya akan menambah baris kosong di sheet.
+    """
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+def check_saved(response: httpx.Response, expected: int) -> None:
+    """Raise WriteNotConfirmed unless the batch reply accounts for all `expected` rows"""
+    try:
+        result = response.json()
+    except ValueError:
+        result = None
+    if isinstance(result, dict):
+        saved, duplicates = result.get("saved"), result.get("duplicates")
+        if isinstance(saved, int) and isinstance(duplicates, int) and saved + duplicates == expected:
+            return
+    text = response.text.strip()
+    if text.startswith("Catatan dengan deskripsi"):
+        # Balasan doPost versi lama: data.rows diabaikan dan satu baris kosong ditambahkan
+        raise WriteNotConfirmed("Apps Script does not support batch writes, redeploy code.gs", permanent=True)
+    raise WriteNotConfirmed(f"Apps Script did not confirm {expected} rows: {text[:200]}")
+
+def expense_from_payload(payload: dict) -> Expense:
+    """Rebuild the local record of a journaled expense"""
+    tanggal = datetime.fromtimestamp(payload["waktu"] / 1000, SHEET_TIMEZONE).strftime("%d-%m-%Y")
+    return Expense(tanggal, int(payload["nominal"]), payload["kategori"].strip(), payload["keterangan"])
+
+class WriteQueue:
+    """
+    Write-behind queue for new expenses
+
+    Pesan user langsung dikonfirmasi setelah catatan masuk jurnal; baris dikumpulkan
+    lalu dikirim ke doPost dalam satu request ({"rows": [...]}) yang ditulis Apps Script
+    dengan satu setValues. Setiap baris membawa id unik sehingga kiriman ulang tidak
+    menggandakan baris di spreadsheet.
+    """
+
+    def __init__(self, journal: WriteJournal, batch_size: int, delay: float, retry_delay: float):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self._rows: list = []  # [(payload, Expense)] yang belum terkirim
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._halted = False  # Apps Script menolak mode batch; kirim ulang setelah restart
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def restore(self) -> None:
+        """Queue again the journaled expenses that never reached the spreadsheet"""
+        payloads = self.journal.load()
+        for payload in payloads:
+            record = expense_from_payload(payload)
+            self._rows.append((payload, record))
+            ledger_sync.record_write(record, confirmed=False)
+        if payloads:
+            logger.info(f"Replaying {len(payloads)} unsaved rows from the write journal")
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        if self._rows:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background sender and try to flush what is left once"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._rows and not self._halted:
+            try:
+                await self.flush()
+            except httpx.HTTPError as e:
+                logger.error(f"Failed to flush {len(self._rows)} queued rows on shutdown, kept in journal: {e}")
+        self.journal.close()
+
+    async def submit(self, payload: dict, record: Expense) -> None:
+        """Journal and queue one expense; it is visible in local summaries immediately"""
+        payload["id"] = uuid.uuid4().hex
+        await asyncio.to_thread(self.journal.add, payload)
+        self._rows.append((payload, record))
+        ledger_sync.record_write(record, confirmed=False)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Send all queued rows, at most `batch_size` per request"""
+        while self._rows:
+            batch = self._rows[:self.batch_size]
+            response = await script_post({"rows": [payload for payload, _ in batch]})
+            check_saved(response, len(batch))
+            # Baru dihapus setelah berhasil, sehingga batch yang gagal tetap di depan antrean
+            del self._rows[:len(batch)]
+            try:
+                await asyncio.to_thread(self.journal.ack, [payload["id"] for payload, _ in batch])
+            except OSError as e:
+                # Tidak fatal: entri akan dikirim ulang saat start dan dilewati oleh Apps Script
+                logger.error(f"Failed to acknowledge rows in write journal: {e}")
+            ledger_sync.confirm_writes([record for _, record in batch])
+            invalidate_ledger()
+            logger.info(f"Saved {len(batch)} queued rows to the spreadsheet ({len(self._rows)} left)")
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.delay)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except httpx.HTTPError as e:
+                if isinstance(e, WriteNotConfirmed) and e.permanent:
+                    self._halted = True
+                    logger.error(f"{e}; {len(self._rows)} queued rows stay in the journal until restart")
+                    return
+                logger.error(f"Failed to send {len(self._rows)} queued rows, retrying in {self.retry_delay}s: {e}")
+                await asyncio.sleep(self.retry_delay)
+                self._wakeup.set()
+            except Exception:
+                # Apa pun yang terjadi, sender harus tetap hidup: baris masih ada di jurnal
+                logger.exception(f"Unexpected error sending {len(self._rows)} queued rows, retrying in {self.retry_delay}s")
+                await asyncio.sleep(self.retry_delay)
+                self._wakeup.set()
+
+write_queue = WriteQueue(WriteJournal(WRITE_JOURNAL_PATH), WRITE_BATCH_SIZE, WRITE_BATCH_DELAY, WRITE_RETRY_DELAY)
+
+def expense_confirmation(tanggal: str, nominal: int, kategori: str, keterangan: str) -> str:
+    """Confirmation text for a saved expense (same layout as the Apps Script reply)"""
+    nominal_text = f"{nominal:,}".replace(",", ".")
+    return (
+        "Catatan dengan deskripsi : \n\n"
+        f"📅 Tanggal : {tanggal}\n"
+        f"🏷 Kategori : {kategori}\n"
+        f"💰 Nominal : Rp. {nominal_text}\n"
+        f"📝 Keterangan : {keterangan}\n\n"
+        "Berhasil disimpan ✅  \n\n"
+        "WARNING: Jangan boros boros yaahh ☺️"
+    )
+
+# ===== Period Query =====
+class Period:
+    """
+    Inclusive span of whole months used by the analysis commands
+
+    Argumen command: `MM/YYYY` (satu bulan), `MM/YYYY-MM/YYYY` (rentang bulan) atau `YYYY` (satu tahun).
+    """
+    __slots__ = ("start", "end", "kind")
+
+    def __init__(self, start: tuple, end: tuple, kind: str):
+        self.start = start  # (year, month)
+        self.end = end
+        self.kind = kind  # "month", "range" atau "year"
+
+    @classmethod
+    def month(cls, year: int, month: int) -> "Period":
+        return cls((year, month), (year, month), "month")
+
+    @classmethod
+    def current(cls) -> "Period":
+        now = datetime.now(SHEET_TIMEZONE)
+        return cls.month(now.year, now.month)
+
+    def months(self) -> list:
+        """Every (year, month) in the period, oldest first"""
+        return [(k // 12, k % 12 + 1) for k in range(period_key(*self.start), period_key(*self.end) + 1)]
+
+    @property
+    def label(self) -> str:
+        if self.kind == "year":
+            return f"Tahun {self.start[0]}"
+        start = f"{get_month_name(self.start[1])} {self.start[0]}"
+        if self.kind == "month":
+            return start
+        return f"{start} - {get_month_name(self.end[1])} {self.end[0]}"
+
+    @property
+    def slug(self) -> str:
+        """Short form for file names"""
+        if self.kind == "year":
+            return str(self.start[0])
+        start = f"{self.start[0]}_{self.start[1]:02d}"
+        if self.kind == "month":
+            return start
+        return f"{start}-{self.end[0]}_{self.end[1]:02d}"
+
+def _parse_month(text: str) -> tuple:
+    month, year = map(int, text.split('/'))
+    if not (1 <= month <= 12 and 2000 <= year <= 2100):
+        raise ValueError(f"Bulan tidak valid: {text}")
+    return year, month
+
+def parse_period(args: list, default: Optional[Period]) -> Optional[Period]:
+    """Parse command arguments into a Period; raises ValueError for invalid input"""
+    if not args:
+        return default
+    # "01/2025-03/2025", "01/2025 03/2025" dan "01/2025 - 03/2025" diterima
+    parts = [part for part in "-".join(args).split("-") if part]
+    if len(parts) == 1 and parts[0].isdigit():
+        year = int(parts[0])
+        if not 2000 <= year <= 2100:
+            raise ValueError(f"Tahun tidak valid: {year}")
+        return Period((year, 1), (year, 12), "year")
+    if len(parts) == 1:
+        return Period.month(*_parse_month(parts[0]))
+    if len(parts) == 2:
+        start, end = _parse_month(parts[0]), _parse_month(parts[1])
+        if start > end:
+            raise ValueError("Bulan awal harus sebelum bulan akhir")
+        return Period(start, end, "month" if start == end else "range")
+    raise ValueError("Terlalu banyak argumen")
+
+def period_usage(command: str) -> str:
+    return (
+        f"Format tidak valid. Gunakan: /{command} MM/YYYY, /{command} MM/YYYY-MM/YYYY atau /{command} YYYY "
+        f"(contoh: /{command} 04/2025)"
+    )
 
+# ===== Helper Functions =====
 def get_month_name(month_num: int) -> str:
     """Get month name from month number (1-12)"""
     months = ["Januari", "Februari", "Maret", "April", "Mei", "Juni", 
               "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
     return months[month_num - 1] if 1 <= month_num <= 12 else ""
 
+def format_rupiah(amount: int) -> str:
+    """Format an amount in rupiah, e.g. Rp 1.234.567"""
+    return f"Rp {int(amount):,}".replace(",", ".")
+
 def normalize_category(kategori: str) -> str:
     """Normalize category name by converting to lowercase and stripping whitespace"""
     return (kategori or "Lainnya").strip().lower()
@@ -89,10 +1778,10 @@ def log_sent(text: str, user_id: int):
 async def backup_data(context: CallbackContext):
     """Periodic data backup"""
     try:
-        data = get_cached_data()
+        data = await get_cached_data()
         backup_file = f"backup_{datetime.now().strftime('%Y%m%d')}.json"
         with open(backup_file, 'w') as f:
-            json.dump(data, f)
+            json.dump([record.to_dict() for record in data], f)
         logger.info(f"Backup created: {backup_file}")
     except Exception as e:
         logger.error(f"Backup failed: {e}")
@@ -104,7 +1793,7 @@ async def check_updates(context: CallbackContext):
         return
         
     try:
-        req = requests.get("https://api.github.com/repos/username/repo/releases/latest", timeout=10)
+        req = await get_http_client().get(UPDATE_CHECK_URL, timeout=HTTP_READ_TIMEOUT)
         latest_version = req.json()['tag_name']
         if latest_version > CURRENT_VERSION:
             await context.bot.send_message(
@@ -114,56 +1803,691 @@ async def check_updates(context: CallbackContext):
     except:
         pass
 
-# ===== Chart Generator =====
-def generate_chart(data: list) -> BytesIO:
+# ===== Chart Rendering =====
+# Semua grafik dirender dengan objek Figure + canvas Agg (tanpa state global pyplot),
+# di process pool terpisah agar render matplotlib tidak memblokir event loop.
+_chart_pool: Optional[ProcessPoolExecutor] = None
+
+def _init_chart_worker() -> None:
+    """Process pool initializer: import matplotlib once per worker"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates  # noqa: F401
+
+def start_chart_pool() -> None:
+    """Start the chart rendering process pool"""
+    global _chart_pool
+    if _chart_pool is None and CHART_WORKERS > 0:
+        _chart_pool = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_chart_worker,
+        )
+
+def stop_chart_pool() -> None:
+    """Stop the chart rendering process pool"""
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+class ChartCache:
     """
-    Generate daily expense chart from data
-    
+    Content-addressed cache of rendered chart PNGs
+
+    Key = nama renderer + SHA-256 dari data yang dirender (label, nilai, judul/periode),
+    jadi data yang sama selalu menghasilkan key yang sama dan bulan yang sudah lewat
+    tidak pernah dirender ulang. Memori dibatasi byte (LRU); salinan opsional di disk
+    bertahan setelah restart dan juga dibatasi byte (file tertua dihapus lebih dulu).
+    """
+
+    def __init__(self, max_bytes: int, directory: str = "", max_disk_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(renderer, args: tuple) -> str:
+        digest = hashlib.sha256(pickle.dumps(args, protocol=4)).hexdigest()
+        return f"{renderer.__name__}-{digest}"
+
+    def _remember(self, key: str, png: bytes) -> None:
+        if len(png) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = png
+        self._size += len(png)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                png = f.read()
+            os.utime(self._path(key))  # tandai baru dipakai untuk pruning
+            return png
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, png: bytes) -> None:
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, self._path(key))
+
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        png = self._entries.get(key)
+        if png is not None:
+            self._entries.move_to_end(key)
+            return png
+        if self.directory:
+            png = await asyncio.to_thread(self._read_disk, key)
+            if png is not None:
+                self._remember(key, png)
+        return png
+
+    async def put(self, key: str, png: bytes) -> None:
+        self._remember(key, png)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write_disk, key, png)
+            except OSError as e:
+                logger.warning(f"Failed to persist chart {key}: {e}")
+
+chart_cache = ChartCache(CHART_CACHE_BYTES, CHART_CACHE_DIR, CHART_CACHE_DISK_BYTES)
+_chart_renders: dict = {}  # key -> render yang sedang berjalan
+
+async def _render_png(renderer, args: tuple) -> bytes:
+    loop = asyncio.get_running_loop()
+    pool = _chart_pool
+    if pool is not None:
+        try:
+            return await loop.run_in_executor(pool, renderer, *args)
+        except BrokenProcessPool:
+            # Banyak render bisa gagal bersamaan; cukup satu yang me-restart pool
+            if _chart_pool is pool:
+                logger.error("Chart process pool broken, restarting")
+                stop_chart_pool()
+                start_chart_pool()
+    # Tanpa pool (CHART_WORKERS=0): Figure/Agg aman dipakai di thread
+    return await asyncio.to_thread(renderer, *args)
+
+async def render_chart(renderer, *args) -> BytesIO:
+    """
+    Render a chart off the event loop, reusing cached PNGs for identical data
+
     Args:
-        data: List of expense records
-        
+        renderer: One of the render_* functions (module-level so it can be pickled)
+        *args: Plain data passed to the renderer
+
     Returns:
         BytesIO: PNG image buffer
     """
+    key = ChartCache.make_key(renderer, args)
+    png = await chart_cache.get(key)
+    if png is not None:
+        return BytesIO(png)
+
+    task = _chart_renders.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_png(renderer, args))
+        _chart_renders[key] = task
+        try:
+            png = await asyncio.shield(task)
+            await chart_cache.put(key, png)
+        finally:
+            _chart_renders.pop(key, None)
+    else:
+        png = await asyncio.shield(task)
+    return BytesIO(png)
+
+def _new_figure(figsize: tuple) -> Figure:
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def _to_png(fig: Figure, **kwargs) -> bytes:
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', **kwargs)
+    return buffer.getvalue()
+
+def _pie_autopct(values: list):
+    total = sum(values)
+    def my_autopct(pct):
+        val = int(round(pct*total/100.0))
+        return f"{pct:.1f}%\n(Rp {val:,})".replace(",", ".")
+    return my_autopct
+
+def render_daily_chart(ordinals: list, amounts: list) -> bytes:
+    """Daily expense bar chart (/grafik)"""
+    import matplotlib.dates as mdates
+    dates = [date.fromordinal(o) for o in ordinals]
+
+    fig = _new_figure((14, 6))
+    ax = fig.subplots()
+    bars = ax.bar(dates, amounts, color="#4285F4")
+
+    # Label nominal hanya untuk periode pendek (kira-kira dua bulan), agar tetap terbaca
+    if len(amounts) <= 62:
+        for bar, amount in zip(bars, amounts):
+            ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height(), f"Rp{int(amount):,}".replace(",", "."),
+                    ha='center', va='bottom', fontsize=8)
+
+    ax.set_ylabel("Nominal")
+    ax.set_title("Grafik Pengeluaran Harian")
+    ax.tick_params(axis='x', rotation=45)
+    ax.set_ylim(0, max(amounts) * 1.2 if amounts else 1)
+
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
+
+    fig.tight_layout()
+    return _to_png(fig)
+
+def render_category_pie(labels: list, values: list, title: str) -> bytes:
+    """Category share pie chart (/kategori)"""
+    fig = _new_figure((10, 8))
+    ax = fig.subplots()
+    pie_colors = matplotlib.colormaps["Pastel1"](range(len(values)))
+
+    wedges, texts, autotexts = ax.pie(
+        values,
+        labels=labels,
+        autopct=_pie_autopct(values),
+        startangle=90,
+        colors=pie_colors,
+        textprops={'fontsize': 8}
+    )
+
+    ax.set_title(title, pad=20)
+    for autotext in autotexts:
+        autotext.set_fontsize(8)
+        autotext.set_fontweight("bold")
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+def render_top_categories(labels: list, values: list, title: str) -> bytes:
+    """Horizontal bar chart of the top categories (/topkategori)"""
+    fig = _new_figure((10, 6))
+    ax = fig.subplots()
+    bar_colors = matplotlib.colormaps["Blues"](np.linspace(0.4, 0.8, len(values)))
+
+    bars = ax.barh(labels, values, color=bar_colors, height=0.6)
+
+    # Tambahkan label nilai
+    ax.bar_label(bars,
+                 labels=[f"Rp{int(v):,}".replace(",", ".") for v in values],
+                 padding=5,
+                 fontsize=9)
+
+    ax.set_title(title, fontsize=12, pad=20)
+    ax.set_xlabel("Total Pengeluaran", fontsize=10)
+    ax.tick_params(axis='both', labelsize=9)
+    ax.invert_yaxis()  # Kategori terbesar di atas
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+def render_report_daily_chart(ordinals: list, amounts: list) -> bytes:
+    """Daily bar chart for a PDF report month"""
+    import matplotlib.dates as mdates
+    dates = [date.fromordinal(o) for o in ordinals]
+
+    fig = _new_figure((14, 6))
+    ax = fig.subplots()
+    bars = ax.bar(dates, amounts, color="#4285F4")
+
+    for bar, amount in zip(bars, amounts):
+        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(),
+                f"Rp{int(amount):,}".replace(",", "."),
+                ha='center', va='bottom', fontsize=8)
+
+    ax.set_ylabel("Nominal", fontsize=9)
+    ax.set_title("Pengeluaran Harian", fontsize=10)
+    ax.tick_params(axis='x', rotation=45, labelsize=8)
+    ax.tick_params(axis='y', labelsize=8)
+    ax.set_ylim(0, max(amounts)*1.2 if amounts else 1)
+
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
+
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+def render_report_category_pie(labels: list, values: list) -> bytes:
+    """Category pie chart for a PDF report month"""
+    fig = _new_figure((8, 8))
+    ax = fig.subplots()
+    pie_colors = matplotlib.colormaps["Pastel1"](range(len(values)))
+
+    wedges, texts, autotexts = ax.pie(
+        values,
+        labels=labels,
+        autopct=_pie_autopct(values),
+        startangle=90,
+        colors=pie_colors,
+        textprops={'fontsize': 7},
+        pctdistance=0.85,
+        labeldistance=1.05
+    )
+
+    ax.set_title("Distribusi Kategori", fontsize=10, pad=20)
+    for autotext in autotexts:
+        autotext.set_fontsize(8)
+        autotext.set_fontweight("bold")
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+def render_report_top_categories(labels: list, values: list) -> bytes:
+    """Top categories bar chart for a PDF report month"""
+    fig = _new_figure((12, 5))
+    ax = fig.subplots()
+    bar_colors = matplotlib.colormaps["Blues"](np.linspace(0.5, 1, len(values)))
+
+    bars = ax.barh(labels, values, color=bar_colors)
+
+    ax.bar_label(bars,
+                 labels=[f"Rp {int(v):,}".replace(",", ".") for v in values],
+                 padding=5,
+                 fontsize=8)
+
+    ax.set_title("Top 5 Kategori", fontsize=10)
+    ax.tick_params(axis='both', labelsize=8)
+    ax.invert_yaxis()
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+def render_monthly_comparison(labels: list, amounts: list) -> bytes:
+    """Month-by-month comparison bar chart for the PDF report"""
+    fig = _new_figure((14, 6))
+    ax = fig.subplots()
+    bars = ax.bar(labels, amounts, color="#34A853")
+
+    for bar, amount in zip(bars, amounts):
+        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(),
+                f"Rp{int(amount):,}".replace(",", "."),
+                ha='center', va='bottom', fontsize=8)
+
+    ax.set_title("Perbandingan Pengeluaran Bulanan", fontsize=10)
+    ax.tick_params(axis='x', rotation=45, labelsize=8)
+    ax.set_ylim(0, max(amounts)*1.2 if amounts else 1)
+    fig.tight_layout()
+    return _to_png(fig, dpi=120, bbox_inches='tight')
+
+# ===== Telegram Upload Reuse =====
+# File yang isinya identik dengan yang pernah dikirim tidak di-upload ulang:
+# file_id dari Telegram disimpan per hash isi dan dipakai lagi.
+def _content_key(kind: str, data: bytes, filename: str = "") -> str:
+    return f"{kind}:{filename}:{hashlib.sha256(data).hexdigest()}"
+
+async def _send_reusing_file_id(kind: str, buffer: BytesIO, filename: str, send, extract_file_id):
+    data = buffer.getvalue()
+    key = _content_key(kind, data, filename)
     try:
-        daily_totals = defaultdict(float)
-        for item in data:
-            tanggal = item.get("tanggal", "").strip()
-            if not tanggal:
-                continue
-            nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-            nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-            if nominal > 0:
-                daily_totals[tanggal] += nominal
+        file_id = await asyncio.to_thread(ledger_store.get_file_id, key)
+    except sqlite3.Error:
+        file_id = None
+
+    if file_id:
+        try:
+            return await send(file_id)
+        except BadRequest as e:
+            logger.warning(f"Cached file_id rejected, uploading again: {e}")
+            try:
+                await asyncio.to_thread(ledger_store.save_file_id, key, None)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to forget file_id for {filename}: {e}")
 
-        sorted_data = sorted(daily_totals.items(), key=lambda x: datetime.strptime(x[0], "%d-%m-%Y"))
-        dates = [datetime.strptime(tgl, "%d-%m-%Y") for tgl, _ in sorted_data]
-        amounts = [jumlah for _, jumlah in sorted_data]
+    message = await send(InputFile(BytesIO(data), filename=filename))
+    try:
+        await asyncio.to_thread(ledger_store.save_file_id, key, extract_file_id(message), TELEGRAM_FILE_IDS_MAX)
+    except (sqlite3.Error, AttributeError, IndexError, TypeError) as e:
+        logger.warning(f"Failed to remember file_id for {filename}: {e}")
+    return message
+
+async def send_photo(update: Update, buffer: BytesIO, caption: str, filename: str):
+    """Reply with a photo, reusing the Telegram file_id of identical earlier uploads"""
+    return await _send_reusing_file_id(
+        "photo", buffer, filename,
+        lambda photo: update.message.reply_photo(photo=photo, caption=caption),
+        lambda message: message.photo[-1].file_id,
+    )
 
-        fig, ax = plt.subplots(figsize=(14, 6))
-        bars = ax.bar(dates, amounts, color="#4285F4")
+async def send_document(update: Update, buffer: BytesIO, filename: str, caption: str):
+    """Reply with a document, reusing the Telegram file_id of identical earlier uploads"""
+    return await _send_reusing_file_id(
+        "document", buffer, filename,
+        lambda document: update.message.reply_document(document=document, caption=caption),
+        lambda message: message.document.file_id,
+    )
 
-        for bar, amount in zip(bars, amounts):
-            ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height(), f"Rp{int(amount):,}".replace(",", "."),
-                    ha='center', va='bottom', fontsize=8)
+# ===== PDF Report =====
+# Laporan disusun dari section per bulan. Isi section (teks tabel, analisis hari
+# tertinggi, data grafik) di-cache per (tahun, bulan) dengan versi data bulan itu,
+# jadi bulan yang sudah tutup tidak dihitung ulang; hanya bulan yang datanya berubah
+# (biasanya bulan berjalan) yang dibangun lagi, secara paralel. PNG grafik tidak disimpan
+# di section: section hanya menyimpan (renderer, args), PNG-nya diambil dari chart_cache.
+class ReportSection:
+    """Prepared content of one month in the PDF report"""
+    __slots__ = ("year", "month", "version", "rows", "total", "highest", "highest_items",
+                 "charts", "chart_bytes")
+
+    def __init__(self, year: int, month: int, version: tuple):
+        self.year = year
+        self.month = month
+        self.version = version
+        self.rows: list = []  # (no, tanggal, kategori, nominal, keterangan) sebagai teks
+        self.total = 0
+        self.highest: Optional[tuple] = None  # (tanggal, total)
+        self.highest_items: list = []  # (kategori, nominal, keterangan)
+        self.charts: tuple = ()  # (renderer, args) grafik harian, pie kategori, top kategori
+        self.chart_bytes = 0  # ukuran PNG saat dirender, untuk estimasi ukuran laporan
+
+class ReportSectionCache:
+    """
+    LRU of ReportSection bounded by the number of table rows held
+
+    Section dari generasi ledger sebelumnya (sebelum full resync) tidak akan cocok lagi
+    dengan versinya, jadi semuanya dibuang begitu generasi baru terlihat; section yang
+    dibangun dari snapshot lama setelah itu tidak disimpan.
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self._sections: OrderedDict = OrderedDict()  # (year, month) -> ReportSection
+        self._rows = 0
+        self._generation: Optional[int] = None
+
+    @staticmethod
+    def _weight(section: ReportSection) -> int:
+        return len(section.rows) + 1
+
+    def get(self, year: int, month: int, version: tuple) -> Optional[ReportSection]:
+        if self._generation is None or version[0] > self._generation:
+            self._sections.clear()
+            self._rows = 0
+            self._generation = version[0]
+        section = self._sections.get((year, month))
+        if section is None or section.version != version:
+            return None
+        self._sections.move_to_end((year, month))
+        return section
+
+    def put(self, section: ReportSection) -> None:
+        key = (section.year, section.month)
+        old = self._sections.pop(key, None)
+        if old is not None:
+            self._rows -= self._weight(old)
+        if section.version[0] != self._generation or self._weight(section) > self.max_rows:
+            return
+        self._sections[key] = section
+        self._rows += self._weight(section)
+        while self._rows > self.max_rows:
+            _, evicted = self._sections.popitem(last=False)
+            self._rows -= self._weight(evicted)
+
+report_sections = ReportSectionCache(REPORT_SECTION_CACHE_ROWS)
+
+async def build_report_section(analytics: LedgerAnalytics, year: int, month: int, version: tuple) -> ReportSection:
+    """Compute the content of one month section and render its charts"""
+    section = ReportSection(year, month, version)
+    month_data = analytics.month_records(year, month)
+
+    for i, item in enumerate(month_data, 1):
+        section.rows.append((str(i), item.tanggal, item.kategori, f"Rp {item.amount:,}".replace(",", "."), item.keterangan))
+    section.total = analytics.month_version(year, month)[1]
+
+    # Highest spending date analysis
+    daily_totals = analytics.daily_totals(year, month)
+    if daily_totals:
+        hari_terbanyak = max(daily_totals, key=daily_totals.get)
+        section.highest = (date.fromordinal(hari_terbanyak).strftime("%d-%m-%Y"), daily_totals[hari_terbanyak])
+        section.highest_items = [
+            (item.kategori, item.amount, item.keterangan) for item in month_data if item.ordinal == hari_terbanyak
+        ]
 
-        ax.set_ylabel("Nominal")
-        ax.set_title("Grafik Pengeluaran Harian")
-        ax.tick_params(axis='x', rotation=45)
-        ax.set_ylim(0, max(amounts) * 1.2 if amounts else 1)
+    daily_days = sorted(daily_totals)
+    category_totals = analytics.category_totals(year, month)
+    top5 = analytics.top_categories(year, month, 5)
+    section.charts = (
+        (render_report_daily_chart, (daily_days, [daily_totals[d] for d in daily_days])),
+        (render_report_category_pie, (
+            [analytics.category_name(k).capitalize() for k in category_totals.keys()],
+            list(category_totals.values()),
+        )),
+        (render_report_top_categories, (
+            [analytics.category_name(k).capitalize() for k, v in top5],
+            [v for k, v in top5],
+        )),
+    )
+    # Dirender sekarang (paralel) agar cache terisi dan ukuran laporan bisa diperkirakan
+    section.chart_bytes = sum(len(png) for png in await section_charts(section))
+    return section
+
+async def section_charts(section: ReportSection) -> list:
+    """PNG bytes of a section's charts, from chart_cache (re-rendered if evicted)"""
+    buffers = await asyncio.gather(*(render_chart(renderer, *args) for renderer, args in section.charts))
+    return [buffer.getvalue() for buffer in buffers]
+
+async def get_report_section(analytics: LedgerAnalytics, year: int, month: int) -> ReportSection:
+    """Get a month section, rebuilding it only when that month's data changed"""
+    # Generasi dari snapshot yang dianalisis: resync yang selesai di tengah /pdf tidak boleh
+    # menandai section dari baris lama sebagai versi baru
+    version = (analytics.generation,) + analytics.month_version(year, month)
+    section = report_sections.get(year, month, version)
+    if section is None:
+        section = await build_report_section(analytics, year, month, version)
+        report_sections.put(section)
+    return section
+
+def report_styles() -> dict:
+    """Paragraph styles used by the PDF report"""
+    styles = getSampleStyleSheet()
+    return {
+        "normal": styles["Normal"],
+        "heading3": styles["Heading3"],
+        "title": ParagraphStyle(
+            name='TitleStyle',
+            parent=styles['Title'],
+            fontSize=14,
+            alignment=TA_CENTER,
+            spaceAfter=20
+        ),
+        "wrap": ParagraphStyle(
+            name='wrap_style',
+            parent=styles['Normal'],
+            alignment=TA_LEFT,
+            wordWrap='CJK',
+            fontSize=8,
+        ),
+        "center": ParagraphStyle(
+            name='center_style',
+            parent=styles['Normal'],
+            alignment=TA_CENTER,
+            fontSize=8,
+        ),
+    }
+
+TABLE_HEADER = ["NO", "Tanggal", "Kategori", "Nominal", "Keterangan"]
+TABLE_COL_WIDTHS = [1.5*cm, 2.5*cm, 3*cm, 2.5*cm, 6*cm]
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#4285F4")),
+    ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('ALIGN', (0,0), (-1,0), 'CENTER'),
+    ('VALIGN', (0,0), (-1,0), 'MIDDLE'),
+    ('ALIGN', (0,1), (0,-1), 'CENTER'),
+    ('ALIGN', (3,1), (3,-1), 'RIGHT'),
+    ('VALIGN', (0,1), (-1,-1), 'TOP'),
+])
+# Panjang teks (Helvetica 8pt) yang masih muat satu baris di kolom Kategori/Keterangan
+WRAP_CHARS = {2: 14, 4: 32}
+
+def table_cell(text: str, column: int, styles: dict):
+    """Plain string for short cells; a Paragraph only when the text has to wrap"""
+    limit = WRAP_CHARS.get(column)
+    if limit is None or len(text) <= limit:
+        return text
+    return Paragraph(escape(text), styles["wrap"])
+
+def transaction_table(rows: list, styles: dict) -> Table:
+    """One chunk of the transactions table"""
+    table_data = [TABLE_HEADER]
+    for row in rows:
+        table_data.append([table_cell(text, column, styles) for column, text in enumerate(row)])
+    table = Table(table_data, repeatRows=1, colWidths=TABLE_COL_WIDTHS)
+    table.setStyle(TABLE_STYLE)
+    return table
+
+def section_flowables(section: ReportSection, charts: list, styles: dict) -> list:
+    """Build fresh ReportLab flowables for a month section (flowables are not shared between builds)"""
+    elements = []
+    month_name = get_month_name(section.month)
+    year = section.year
+
+    # Month title
+    elements.append(Paragraph(f"LAPORAN PENGELUARAN {month_name.upper()} {year}", styles["title"]))
+    elements.append(Spacer(1, 12))
+
+    # Transactions table, dipecah per PDF_TABLE_CHUNK_ROWS baris agar layout tetap ringan
+    for start in range(0, max(len(section.rows), 1), PDF_TABLE_CHUNK_ROWS):
+        elements.append(transaction_table(section.rows[start:start + PDF_TABLE_CHUNK_ROWS], styles))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph(
+        f"<b>TOTAL PENGELUARAN {month_name.upper()} {year}:</b> Rp {int(section.total):,}".replace(",", "."),
+        styles["heading3"]
+    ))
+
+    if section.highest:
+        tanggal_terbanyak, jumlah_terbanyak = section.highest
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(
+            f"<b>Pengeluaran tertinggi pada bulan {month_name} terjadi pada tanggal {tanggal_terbanyak} dengan total sebesar:</b> Rp {int(jumlah_terbanyak):,}".replace(",", "."),
+            styles["normal"]
+        ))
+
+        elements.append(Spacer(1, 6))
+        elements.append(Paragraph(f"<b>Berikut rincian pengeluarannya:</b>", styles["normal"]))
+
+        for i, (kategori, nominal, keterangan) in enumerate(section.highest_items, 1):
+            nominal_text = f"Rp {nominal:,}".replace(",", ".")
+            elements.append(Paragraph(
+                f"{i}. Kategori: {escape(kategori)}<br/>"
+                f"&nbsp;&nbsp;&nbsp;&nbsp;Total: {nominal_text}<br/>"
+                f"&nbsp;&nbsp;&nbsp;&nbsp;Keterangan: {escape(keterangan)}",
+                styles["normal"]
+            ))
+            elements.append(Spacer(1, 6))
+
+    # Move charts to new page
+    elements.append(PageBreak())
+    elements.append(Paragraph(f"ANALISIS PENGELUARAN {month_name.upper()} {year}", styles["title"]))
+    elements.append(Spacer(1, 12))
+
+    daily_chart, category_chart, top_chart = charts
+    elements.append(RLImage(BytesIO(daily_chart), width=15*cm, height=7*cm))
+    elements.append(Spacer(1, 0.5*cm))
+    elements.append(RLImage(BytesIO(category_chart), width=10*cm, height=10*cm))
+    elements.append(Spacer(1, 0.5*cm))
+    elements.append(RLImage(BytesIO(top_chart), width=15*cm, height=5*cm))
+    return elements
+
+def comparison_flowables(chart: bytes, styles: dict) -> list:
+    """Monthly comparison page of a multi-month report"""
+    return [
+        Paragraph("PERBANDINGAN BULANAN", styles["title"]),
+        Spacer(1, 12),
+        RLImage(BytesIO(chart), width=15*cm, height=7*cm),
+    ]
+
+def build_pdf(elements: list) -> BytesIO:
+    """Build the PDF document (blocking; run in a thread)"""
+    buffer = BytesIO()
+    # invariant=1: tanpa timestamp/ID acak, sehingga laporan yang sama menghasilkan byte yang sama
+    doc = SimpleDocTemplate(buffer, pagesize=A4, 
+                          rightMargin=2*cm, leftMargin=2*cm, 
+                          topMargin=2*cm, bottomMargin=2*cm,
+                          invariant=1)
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+def estimate_report_bytes(sections: list) -> int:
+    """Rough size of the PDF for the given sections (charts + ~120 byte per table row)"""
+    return sum(
+        s.chart_bytes + 120 * len(s.rows) + 4096
+        for s in sections
+    )
 
-        import matplotlib.dates as mdates
-        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
+def _zip_write(archive: zipfile.ZipFile, name: str, data: bytes) -> None:
+    # Tanggal tetap agar zip untuk isi yang sama menghasilkan byte yang sama
+    archive.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data)
 
-        fig.tight_layout()
+async def build_split_report(sections: list, styles: dict, comparison_chart: Optional[bytes]):
+    """
+    Build one PDF per month and yield zip parts under the Telegram document limit
 
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
+    PDF dibangun satu per satu dan langsung ditulis ke zip sebelum PDF berikutnya,
+    sehingga memori dibatasi satu PDF ditambah satu bagian zip, berapa pun jumlah bulannya.
+    """
+    jobs = [(f"laporan_{section.year}_{section.month:02d}.pdf", section) for section in sections]
+    if comparison_chart:
+        jobs.append(("perbandingan_bulanan.pdf", None))
+
+    buffer, archive, size = None, None, 0
+    for name, section in jobs:
+        if section is None:
+            elements = comparison_flowables(comparison_chart, styles)
+        else:
+            # PNG diambil per bulan, tepat sebelum PDF bulan itu dibangun
+            elements = section_flowables(section, await section_charts(section), styles)
+        data = (await asyncio.to_thread(build_pdf, elements)).getvalue()
+        if len(data) > TELEGRAM_DOCUMENT_LIMIT:
+            logger.warning(f"{name} ({len(data)} byte) melebihi batas dokumen Telegram")
+
+        entry = len(data) + 2 * len(name) + 128  # header lokal + central directory
+        if archive is not None and size + entry > TELEGRAM_DOCUMENT_LIMIT:
+            archive.close()
+            buffer.seek(0)
+            yield buffer
+            archive = None
+        if archive is None:
+            buffer, size = BytesIO(), 0
+            # PDF dan PNG di dalamnya sudah terkompresi, jadi cukup disimpan
+            archive = zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED)
+        await asyncio.to_thread(_zip_write, archive, name, data)
+        size += entry
+
+    if archive is not None:
+        archive.close()
         buffer.seek(0)
-        return buffer
-    finally:
-        plt.close('all')
+        yield buffer
 
 # ===== Commands =====
 async def start(update: Update, context: CallbackContext) -> None:
@@ -180,8 +2504,9 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "\n   `50.000, Makanan, Makan siang`"
         "\n   `50000, Makanan, Makan siang`"
         "\n\n• Perintah yang tersedia:"
-        "\n    /info - Melihat detail pengeluaran"
+        "\n    /info - Melihat detail pengeluaran (terbaru dulu, tombol untuk pindah halaman)"
         "\n    /pdf - Mendapatkan laporan dalam format PDF"
+        "\n        `/pdf` seluruh riwayat, `/pdf 04/2025` hanya April 2025"
         "\n    /grafik - Menampilkan grafik pengeluaran harian"
         "\n\n• Analisis Kategori:"
         "\n    /kategori - Diagram pie persentase pengeluaran per kategori"
@@ -200,10 +2525,24 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "\n        - 5 kategori dengan pengeluaran terbesar"
         "\n        - Nominal total per kategori"
         "\n        - Warna gradient biru"
+        "\n\n• Budget Bulanan:"
+        "\n    /budget - Melihat pemakaian budget bulan ini"
+        "\n        `/budget Makanan 1.500.000` mengatur budget kategori"
+        "\n        Peringatan otomatis saat pemakaian mencapai 80% dan 100%"
+        "\n\n• Pencarian:"
+        "\n    /cari - Mencari catatan berdasarkan keterangan/kategori"
+        "\n        `/cari kopi`, `/cari makan siang` (awalan kata juga cocok)"
+        "\n\n• Rentang Tanggal:"
+        "\n    /range - Total 7 hari, 30 hari terakhir dan sejak awal tahun"
+        "\n        `/range 7`, `/range 30`, `/range ytd`"
+        "\n        `/range 01-03-2025 15-04-2025` untuk rentang bebas"
         "\n\n• Filter Waktu:"
-        "\n    Semua command analisis mendukung filter bulan/tahun:"
-        "\n    - Format: MM/YYYY (contoh: 04/2025)"
+        "\n    /pdf, /grafik, /kategori dan /topkategori mendukung filter periode:"
+        "\n    - Satu bulan: MM/YYYY (contoh: 04/2025)"
+        "\n    - Rentang bulan: MM/YYYY-MM/YYYY (contoh: 01/2025-03/2025)"
+        "\n    - Satu tahun: YYYY (contoh: 2025)"
         "\n    - Jika tidak ditentukan, akan menggunakan bulan saat ini"
+        "\n      (kecuali /pdf, yang tanpa periode berisi seluruh riwayat)"
     )
 
     await update.message.reply_text(help_text, parse_mode='Markdown')
@@ -211,20 +2550,13 @@ async def help_command(update: Update, context: CallbackContext) -> None:
 
 async def handle_message(update: Update, context: CallbackContext) -> None:
     # Rate limiting
-    current_time = time.time()
-    if current_time - user_last_message[update.effective_user.id] < MESSAGE_COOLDOWN:
-        await update.message.reply_text("⏳ Harap tunggu sebentar sebelum mengirim pesan lagi")
+    if not await allow_request(update, "text"):
         return
-    user_last_message[update.effective_user.id] = current_time
 
     log_received(update)
     user_id = update.effective_user.id
 
     try:
-        if not check_internet():
-            await update.message.reply_text("⚠️ Tidak ada koneksi internet")
-            return
-
         text = update.message.text
         if len(text.split(", ")) != 3:
             await update.message.reply_text("Format salah! Gunakan format: nominal, kategori, keterangan.\n\nKetik /help untuk melihat panduan penggunaan bot.")
@@ -239,234 +2571,227 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
             log_sent(msg, user_id)
             return
 
-        data = {"nominal": nominal, "kategori": kategori, "keterangan": keterangan}
-        response = requests.post(GOOGLE_SCRIPT_URL, json=data, timeout=10)
-        response.raise_for_status()
-        await update.message.reply_text(response.text)
-        log_sent(response.text, user_id)
-    except ValueError:
-        msg = "Format salah! Gunakan format: nominal, kategori, keterangan.\n\nKetik /help untuk melihat panduan penggunaan bot."
-        await update.message.reply_text(msg)
-        log_sent(msg, user_id)
-    except requests.exceptions.Timeout:
-        msg = "⏱ Waktu koneksi habis, silakan coba lagi"
+        # Dicatat di jurnal lokal lalu dikirim ke spreadsheet di latar belakang
+        # Tanggal mengikuti zona spreadsheet, bukan zona host bot
+        waktu = datetime.now(SHEET_TIMEZONE)
+        data = {"waktu": int(waktu.timestamp() * 1000), "nominal": nominal, "kategori": kategori, "keterangan": keterangan}
+        record = Expense(waktu.strftime("%d-%m-%Y"), int(nominal), kategori.strip(), keterangan)
+        try:
+            await write_queue.submit(data, record)
+        except OSError as e:
+            logger.error(f"Failed to write expense to journal: {e}")
+            msg = "⚠️ Gagal menyimpan catatan, silakan coba lagi"
+            await update.message.reply_text(msg)
+            log_sent(msg, user_id)
+            return
+
+        msg = expense_confirmation(record.tanggal, record.amount, kategori, keterangan)
+        warning = budget_book.check(record)
+        if warning:
+            msg += f"\n\n{warning}"
         await update.message.reply_text(msg)
         log_sent(msg, user_id)
-    except requests.exceptions.RequestException as e:
-        msg = f"Gagal mengirim data: {str(e)}"
+    except ValueError:
+        msg = "Format salah! Gunakan format: nominal, kategori, keterangan.\n\nKetik /help untuk melihat panduan penggunaan bot."
         await update.message.reply_text(msg)
         log_sent(msg, user_id)
 
+def info_field(text: str, limit: int) -> str:
+    """User text escaped for a Markdown message and clipped to `limit` characters"""
+    text = escape_markdown(text or "-", version=1)
+    if len(text) > limit:
+        # Jangan sisakan backslash escape yang terpotong
+        text = text[:limit].rstrip("\\") + "…"
+    return text
+
+def render_info_page(records: list, anchor: int, page: int) -> tuple:
+    """
+    Render one /info page, newest first, in O(page size)
+
+    `anchor` adalah jumlah baris saat /info dibuka; halaman dihitung mundur dari situ
+    sehingga catatan baru tidak menggeser isi halaman yang sedang dibuka.
+    Returns (text, InlineKeyboardMarkup or None).
+    """
+    anchor = min(anchor, len(records))
+    pages = max(1, math.ceil(anchor / INFO_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    hi = anchor - page * INFO_PAGE_SIZE
+    lo = max(0, hi - INFO_PAGE_SIZE)
+
+    lines = [f"*CATATAN PENGELUARAN* (halaman {page + 1}/{pages})\n"]
+    for i in range(hi - 1, lo - 1, -1):
+        item = records[i]
+        # Teks user di-escape (satu `_`/`*` bisa membuat Telegram menolak pesan) dan dibatasi
+        # agar satu halaman tetap di bawah batas 4096 karakter
+        lines.append(
+            f"{i + 1}. Tanggal: {info_field(item.tanggal, 20)}\n"
+            f"   Kategori: {info_field(item.kategori, 60)}\n"
+            f"   Nominal: {format_rupiah(item.amount)}\n"
+            f"   Keterangan: {info_field(item.keterangan, 200)}\n"
+        )
+    lines.append(f"*TOTAL PENGELUARAN:* {format_rupiah(ledger_sync.total)}")
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Lebih baru", callback_data=f"info:{anchor}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Lebih lama ➡️", callback_data=f"info:{anchor}:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def lihat_data(update: Update, context: CallbackContext) -> None:
     log_received(update)
     log_command("/info", update.effective_user.id)
+    if not await allow_request(update, "info"):
+        return
 
     try:
-        if not check_internet():
-            await update.message.reply_text("⚠️ Tidak ada koneksi internet")
-            return
-
-        data = get_cached_data()
+        # Saat backend mati, get_cached_data langsung menyajikan cache (circuit breaker)
+        data = await get_cached_data()
         if not data:
-            msg = "Tidak ada catatan pengeluaran."
+            msg = "Tidak ada catatan pengeluaran." if ledger_cache.loaded else BACKEND_DOWN_MESSAGE
             await update.message.reply_text(msg)
             log_sent(msg, update.effective_user.id)
             return
 
-        message = "*CATATAN PENGELUARAN:*\n\n"
-        total = 0
-
-        for i, item in enumerate(data, 1):
-            nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-            nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-            total += nominal
-            message += (
-                f"{i}. Tanggal: {item.get('tanggal', '-')}\n"
-                f"   Kategori: {item.get('kategori', '-')}\n"
-                f"   Nominal: Rp {int(nominal):,}".replace(",", ".") + "\n"
-                f"   Keterangan: {item.get('keterangan', '-')}\n\n"
-            )
-
-        message += f"*TOTAL PENGELUARAN:* Rp {int(total):,}".replace(",", ".")
-
-        if len(message) > 4096:
-            buffer = BytesIO(message.encode('utf-8'))
-            buffer.seek(0)
-            await update.message.reply_document(
-                document=buffer,
-                filename="pengeluaran.txt",
-                caption="Data pengeluaran (terlalu panjang untuk pesan biasa)"
-            )
-        else:
-            await update.message.reply_text(message, parse_mode="Markdown")
-            
+        # Halaman pertama = catatan terbaru; anchor membekukan jumlah baris untuk navigasi
+        message, keyboard = render_info_page(data, len(data), 0)
+        await update.message.reply_text(message, parse_mode="Markdown", reply_markup=keyboard)
         log_sent("Mengirim data pengeluaran ke user.", update.effective_user.id)
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         msg = f"Gagal mengambil data: {str(e)}"
         await update.message.reply_text(msg)
         log_sent(msg, update.effective_user.id)
 
+async def info_navigation(update: Update, context: CallbackContext) -> None:
+    """Inline next/prev buttons of /info (callback data "info:<anchor>:<page>")"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    wait = rate_limiter.acquire(user_id, COMMAND_COSTS["info_page"])
+    if wait > 0:
+        await query.answer(f"⏳ Harap tunggu {math.ceil(wait)} detik")
+        return
+
+    try:
+        _, anchor, page = query.data.split(":")
+        anchor, page = int(anchor), int(page)
+    except ValueError:
+        await query.answer()
+        return
+
+    data = await get_cached_data()
+    await query.answer()
+    if not data:
+        return
+
+    message, keyboard = render_info_page(data, anchor, page)
+    try:
+        await query.edit_message_text(message, parse_mode="Markdown", reply_markup=keyboard)
+    except BadRequest as e:
+        # Tombol ditekan dua kali: isi halaman tidak berubah
+        if "not modified" in str(e).lower():
+            return
+        # error_handler tidak bisa membalas callback query (update.message kosong)
+        logger.error(f"Failed to show info page {page + 1} to user_id={user_id}: {e}")
+        await query.message.reply_text("⚠️ Gagal menampilkan halaman ini, silakan coba lagi")
+        return
+    logger.info(f"Info page {page + 1} sent to user_id={user_id}")
+
 async def kirim_grafik(update: Update, context: CallbackContext) -> None:
     log_received(update)
     log_command("/grafik", update.effective_user.id)
+    if not await allow_request(update, "grafik"):
+        return
 
     try:
-        if not check_internet():
-            await update.message.reply_text("⚠️ Tidak ada koneksi internet")
+        # Default bulan saat ini; bisa juga MM/YYYY, rentang bulan atau satu tahun
+        try:
+            period = parse_period(context.args, Period.current())
+        except ValueError:
+            await update.message.reply_text(period_usage("grafik"))
             return
 
-        data = get_cached_data()
-        if not data:
-            msg = "Tidak ada data untuk ditampilkan."
-            await update.message.reply_text(msg)
-            log_sent(msg, update.effective_user.id)
-            return
+        # Hanya bulan dalam periode yang diambil
+        summary = await get_period_summary(period)
 
-        # Dapatkan bulan dan tahun saat ini
-        now = datetime.now()
-        current_month = now.month
-        current_year = now.year
-        
-        # Filter data hanya untuk bulan ini
-        monthly_data = []
-        for item in data:
-            tanggal = item.get("tanggal", "")
-            if tanggal:
-                try:
-                    day, month, year = map(int, tanggal.split('-'))
-                    if month == current_month and year == current_year:
-                        monthly_data.append(item)
-                except:
-                    continue
-
-        if not monthly_data:
-            msg = f"Tidak ada data pengeluaran untuk bulan {get_month_name(current_month)} {current_year}."
+        if not summary and not backend_health.available:
+            # Ringkasan tidak bisa diambil dan tidak ada di cache
+            await update.message.reply_text(BACKEND_DOWN_MESSAGE)
+            log_sent(BACKEND_DOWN_MESSAGE, update.effective_user.id)
+            return
+        if not summary.get("count"):
+            msg = f"Tidak ada data pengeluaran untuk {period.label}."
             await update.message.reply_text(msg)
             log_sent(msg, update.effective_user.id)
             return
 
-        # Buat grafik untuk bulan ini
-        chart_buffer = generate_chart(monthly_data)
-        month_name = get_month_name(current_month)
+        # Buat grafik untuk periode ini
+        daily = sorted((datetime.strptime(tgl, "%d-%m-%Y").toordinal(), total) for tgl, total in summary["daily"].items())
+        async with render_slot(update):
+            chart_buffer = await render_chart(render_daily_chart, [o for o, _ in daily], [t for _, t in daily])
 
-        await update.message.reply_photo(
-            photo=chart_buffer,
-            caption=f"Grafik Pengeluaran Harian Bulan {month_name} {current_year}",
-            filename=f"grafik_pengeluaran_{month_name}_{current_year}.png"
+        await send_photo(
+            update,
+            chart_buffer,
+            caption=f"Grafik Pengeluaran Harian {period.label}",
+            filename=f"grafik_pengeluaran_{period.slug}.png"
         )
-        log_sent(f"Mengirim grafik pengeluaran bulan {month_name}.", update.effective_user.id)
+        log_sent(f"Mengirim grafik pengeluaran {period.label}.", update.effective_user.id)
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         msg = f"Gagal mengambil data: {str(e)}"
         await update.message.reply_text(msg)
         log_sent(msg, update.effective_user.id)
 async def kategori_pie(update: Update, context: CallbackContext):
     log_received(update)
     log_command("/kategori", update.effective_user.id)
+    if not await allow_request(update, "kategori"):
+        return
 
     try:
-        # Default to current month/year
-        now = datetime.now()
-        current_month = now.month
-        current_year = now.year
-        
-        # Parse month/year from command args
-        if context.args:
-            try:
-                month, year = map(int, context.args[0].split('/'))
-                if 1 <= month <= 12 and 2000 <= year <= 2100:
-                    current_month = month
-                    current_year = year
-                else:
-                    await update.message.reply_text("Format bulan/tahun tidak valid. Gunakan: /kategori MM/YYYY (contoh: /kategori 04/2025)")
-                    return
-            except:
-                await update.message.reply_text("Format tidak valid. Gunakan: /kategori MM/YYYY (contoh: /kategori 04/2025)")
-                return
+        # Default to current month; also accepts a month range or a year
+        try:
+            period = parse_period(context.args, Period.current())
+        except ValueError:
+            await update.message.reply_text(period_usage("kategori"))
+            return
 
-        month_name = get_month_name(current_month)
-        
-        response = requests.get(GOOGLE_SCRIPT_URL + "?action=getData", timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        summary = await get_period_summary(period)
 
-        if not data:
-            await update.message.reply_text("Belum ada data pengeluaran.")
+        if not summary and not backend_health.available:
+            await update.message.reply_text(BACKEND_DOWN_MESSAGE)
+            log_sent(BACKEND_DOWN_MESSAGE, update.effective_user.id)
             return
-
-        # Filter data by month/year
-        filtered_data = []
-        for item in data:
-            tanggal = item.get("tanggal", "")
-            if tanggal:
-                try:
-                    day, month, year = map(int, tanggal.split('-'))
-                    if month == current_month and year == current_year:
-                        filtered_data.append(item)
-                except:
-                    continue
-
-        if not filtered_data:
-            await update.message.reply_text(f"Tidak ada data pengeluaran untuk {month_name} {current_year}.")
+        if not summary.get("count"):
+            await update.message.reply_text(f"Tidak ada data pengeluaran untuk {period.label}.")
             return
 
-        # Calculate category totals with normalized names
-        categories = defaultdict(float)
-        original_names = {}  # To store the original name for display
-        
-        for item in filtered_data:
-            original_kategori = item.get("kategori", "Lainnya").strip()
-            normalized_kategori = normalize_category(original_kategori)
-            nominal = float(str(item.get("nominal", "0")).replace(".", "").replace(",", ""))
-            categories[normalized_kategori] += nominal
-            
-            # Store the original name (capitalized) for display
-            if normalized_kategori not in original_names:
-                original_names[normalized_kategori] = original_kategori.capitalize()
-
-        # Create pie chart with improved formatting
-        fig, ax = plt.subplots(figsize=(10, 8))
-        colors = plt.cm.Pastel1(range(len(categories)))
-        
-        def make_autopct(values):
-            def my_autopct(pct):
-                total = sum(values)
-                val = int(round(pct*total/100.0))
-                return f"{pct:.1f}%\n(Rp {val:,})".replace(",", ".")
-            return my_autopct
-        
-        wedges, texts, autotexts = ax.pie(
-            categories.values(),
-            labels=[original_names[k] for k in categories.keys()],  # Use original capitalized names
-            autopct=make_autopct(categories.values()),
-            startangle=90,
-            colors=colors,
-            textprops={'fontsize': 8}
-        )
-        
-        ax.set_title(f"Persentase Pengeluaran per Kategori\n{month_name} {current_year}", pad=20)
-        plt.setp(autotexts, size=8, weight="bold")
-        plt.tight_layout()
-
-        # Send as image
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
+        # Category totals (already normalized by the Apps Script)
+        categories = {k: v["total"] for k, v in summary["categories"].items()}
+        original_names = {k: v["name"].capitalize() for k, v in summary["categories"].items()}
+
+        # Create pie chart off the event loop
+        async with render_slot(update):
+            buf = await render_chart(
+                render_category_pie,
+                [original_names[k] for k in categories.keys()],  # Use original capitalized names
+                list(categories.values()),
+                f"Persentase Pengeluaran per Kategori\n{period.label}",
+            )
         
-        caption = f"📊 Distribusi Pengeluaran {month_name} {current_year}:\n"
+        caption = f"📊 Distribusi Pengeluaran {period.label}:\n"
         # Sort by amount descending and use original capitalized names
         sorted_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)
         caption += "\n".join([f"• {original_names[k]}: Rp {int(v):,}".replace(",", ".") 
                             for k, v in sorted_categories])
         
-        await update.message.reply_photo(
-            photo=buf,
+        await send_photo(
+            update,
+            buf,
             caption=caption,
-            filename=f"kategori_{current_month}_{current_year}.png"
+            filename=f"kategori_{period.slug}.png"
         )
-        log_sent(f"Mengirim grafik kategori {month_name} {current_year}", update.effective_user.id)
+        log_sent(f"Mengirim grafik kategori {period.label}", update.effective_user.id)
 
     except Exception as e:
         await update.message.reply_text(f"Error: {str(e)}")
@@ -476,112 +2801,62 @@ async def top_kategori(update: Update, context: CallbackContext):
     """Menampilkan 5 kategori pengeluaran tertinggi dalam bentuk grafik batang horizontal"""
     log_received(update)
     log_command("/topkategori", update.effective_user.id)
+    if not await allow_request(update, "topkategori"):
+        return
 
     try:
-        # Default ke bulan/tahun sekarang
-        now = datetime.now()
-        current_month = now.month
-        current_year = now.year
-        
-        # Parse parameter bulan/tahun jika ada
-        if context.args:
-            try:
-                month, year = map(int, context.args[0].split('/'))
-                if not (1 <= month <= 12 and 2000 <= year <= 2100):
-                    await update.message.reply_text("Format bulan/tahun tidak valid. Gunakan: /topkategori MM/YYYY (contoh: /topkategori 04/2025)")
-                    return
-                current_month = month
-                current_year = year
-            except:
-                await update.message.reply_text("Format tidak valid. Gunakan: /topkategori MM/YYYY (contoh: /topkategori 04/2025)")
-                return
-
-        month_name = get_month_name(current_month)
-        
-        # Ambil data terbaru (force refresh)
-        response = requests.get(GOOGLE_SCRIPT_URL + "?action=getData", timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        if not data:
-            await update.message.reply_text("Belum ada data pengeluaran.")
+        # Default ke bulan sekarang; bisa juga rentang bulan atau satu tahun
+        try:
+            period = parse_period(context.args, Period.current())
+        except ValueError:
+            await update.message.reply_text(period_usage("topkategori"))
             return
 
-        # Filter data berdasarkan bulan/tahun
-        filtered_data = [
-            item for item in data 
-            if item.get("tanggal") and 
-            datetime.strptime(item["tanggal"], "%d-%m-%Y").month == current_month and
-            datetime.strptime(item["tanggal"], "%d-%m-%Y").year == current_year
-        ]
+        # Ringkasan hanya untuk bulan dalam periode
+        summary = await get_period_summary(period)
 
-        if not filtered_data:
-            await update.message.reply_text(f"Tidak ada data pengeluaran untuk {month_name} {current_year}.")
+        if not summary and not backend_health.available:
+            await update.message.reply_text(BACKEND_DOWN_MESSAGE)
+            log_sent(BACKEND_DOWN_MESSAGE, update.effective_user.id)
+            return
+        if not summary.get("count"):
+            await update.message.reply_text(f"Tidak ada data pengeluaran untuk {period.label}.")
             return
 
-        # Hitung total per kategori
-        categories = defaultdict(float)
-        original_names = {}
-        
-        for item in filtered_data:
-            original_kategori = item.get("kategori", "Lainnya").strip()
-            normalized_kategori = normalize_category(original_kategori)
-            nominal = float(str(item.get("nominal", "0")).replace(".", "").replace(",", ""))
-            categories[normalized_kategori] += nominal
-            
-            if normalized_kategori not in original_names:
-                original_names[normalized_kategori] = original_kategori.capitalize()
+        # Total per kategori (sudah dinormalisasi oleh Apps Script)
+        categories = {k: v["total"] for k, v in summary["categories"].items()}
+        original_names = {k: v["name"].capitalize() for k, v in summary["categories"].items()}
 
         # Ambil top 5 kategori
         top5 = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:5]
         
         if not top5:
-            await update.message.reply_text(f"Tidak ada data kategori untuk {month_name} {current_year}.")
+            await update.message.reply_text(f"Tidak ada data kategori untuk {period.label}.")
             return
 
-        # Buat grafik batang horizontal
-        fig, ax = plt.subplots(figsize=(10, 6))
-        colors = plt.cm.Blues(np.linspace(0.4, 0.8, len(top5)))
-        
-        bars = ax.barh(
-            [original_names[k] for k, v in top5],
-            [v for k, v in top5],
-            color=colors,
-            height=0.6
-        )
-        
-        # Tambahkan label nilai
-        ax.bar_label(bars, 
-                    labels=[f"Rp{int(v):,}".replace(",", ".") for k, v in top5],
-                    padding=5,
-                    fontsize=9)
-        
-        ax.set_title(f"5 Kategori Pengeluaran Tertinggi\n{month_name} {current_year}", 
-                    fontsize=12, pad=20)
-        ax.set_xlabel("Total Pengeluaran", fontsize=10)
-        ax.tick_params(axis='both', labelsize=9)
-        ax.invert_yaxis()  # Kategori terbesar di atas
-        plt.tight_layout()
-
-        # Kirim sebagai gambar
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
+        # Buat grafik batang horizontal (dirender di luar event loop)
+        async with render_slot(update):
+            buf = await render_chart(
+                render_top_categories,
+                [original_names[k] for k, v in top5],
+                [v for k, v in top5],
+                f"5 Kategori Pengeluaran Tertinggi\n{period.label}",
+            )
         
         # Buat caption
-        caption = f"🏆 Top 5 Kategori Pengeluaran {month_name} {current_year}:\n"
+        caption = f"🏆 Top 5 Kategori Pengeluaran {period.label}:\n"
         for i, (k, v) in enumerate(top5, 1):
             caption += f"{i}. {original_names[k]}: Rp{int(v):,}\n".replace(",", ".")
         
-        await update.message.reply_photo(
-            photo=buf,
+        await send_photo(
+            update,
+            buf,
             caption=caption,
-            filename=f"top_kategori_{current_month}_{current_year}.png"
+            filename=f"top_kategori_{period.slug}.png"
         )
-        log_sent(f"Mengirim top kategori {month_name} {current_year}", update.effective_user.id)
+        log_sent(f"Mengirim top kategori {period.label}", update.effective_user.id)
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         await update.message.reply_text(f"⚠️ Gagal mengambil data: {str(e)}")
         logger.error(f"Request error in top_kategori: {str(e)}")
     except ValueError as e:
@@ -591,378 +2866,342 @@ async def top_kategori(update: Update, context: CallbackContext):
         await update.message.reply_text(f"⚠️ Terjadi kesalahan: {str(e)}")
         logger.error(f"Unexpected error in top_kategori: {str(e)}", exc_info=True)
 
-async def kirim_pdf(update: Update, context: CallbackContext) -> None:
+def range_report(index: DateIndex, start: date, end: date) -> str:
+    """Total, daily average and category breakdown between two dates"""
+    count, total = index.range_total(start.toordinal(), end.toordinal())
+    days = end.toordinal() - start.toordinal() + 1
+    lines = [
+        f"📅 PENGELUARAN {start.strftime('%d-%m-%Y')} s/d {end.strftime('%d-%m-%Y')}",
+        "",
+        f"Jumlah transaksi: {count}",
+        f"Total: {format_rupiah(total)}",
+        f"Rata-rata per hari: {format_rupiah(total // days)}",
+    ]
+    categories = sorted(index.range_categories(start.toordinal(), end.toordinal()).items(),
+                        key=lambda x: x[1], reverse=True)
+    if categories:
+        lines.append("")
+        lines.append("Per kategori:")
+        lines.extend(f"• {index.category_name(k).capitalize()}: {format_rupiah(v)}" for k, v in categories[:10])
+        if len(categories) > 10:
+            lines.append(f"• ... dan {len(categories) - 10} kategori lainnya")
+    return "\n".join(lines)
+
+def rolling_report(index: DateIndex, today: date) -> str:
+    """Rolling 7/30-day windows and year-to-date totals"""
+    windows = [
+        ("7 hari terakhir", today.toordinal() - 6),
+        ("30 hari terakhir", today.toordinal() - 29),
+        (f"Tahun ini (sejak 01-01-{today.year})", date(today.year, 1, 1).toordinal()),
+    ]
+    lines = ["📊 RINGKASAN PENGELUARAN", ""]
+    for label, start in windows:
+        count, total = index.range_total(start, today.toordinal())
+        lines.append(f"• {label}: {format_rupiah(total)} ({count} transaksi)")
+    lines.append("")
+    lines.append("Gunakan /range dd-mm-yyyy dd-mm-yyyy untuk rentang lain.")
+    return "\n".join(lines)
+
+RANGE_USAGE = (
+    "Format tidak valid. Gunakan:\n"
+    "/range - ringkasan 7 hari, 30 hari dan tahun ini\n"
+    "/range 7 atau /range 30 - N hari terakhir\n"
+    "/range ytd - sejak awal tahun\n"
+    "/range dd-mm-yyyy dd-mm-yyyy (contoh: /range 01-03-2025 15-04-2025)"
+)
+
+async def rentang_tanggal(update: Update, context: CallbackContext) -> None:
+    """Spending over an arbitrary date range, rolling windows or year-to-date"""
     log_received(update)
-    log_command("/pdf", update.effective_user.id)
+    log_command("/range", update.effective_user.id)
+    if not await allow_request(update, "range"):
+        return
 
+    today = datetime.now(SHEET_TIMEZONE).date()
+    args = context.args or []
+    start = end = None
     try:
-        # Force refresh data to get latest entries
-        data = get_cached_data(force_refresh=True)
-        
+        if len(args) == 1 and args[0].lower() == "ytd":
+            start, end = date(today.year, 1, 1), today
+        elif len(args) == 1 and args[0].isdigit() and 1 <= int(args[0]) <= 3660:
+            start, end = date.fromordinal(today.toordinal() - int(args[0]) + 1), today
+        elif len(args) == 2:
+            start = datetime.strptime(args[0], "%d-%m-%Y").date()
+            end = datetime.strptime(args[1], "%d-%m-%Y").date()
+            if start > end:
+                raise ValueError("Tanggal awal harus sebelum tanggal akhir")
+        elif args:
+            raise ValueError("Argumen tidak dikenal")
+    except ValueError:
+        await update.message.reply_text(RANGE_USAGE)
+        return
+
+    try:
+        data = await get_cached_data()
         if not data:
-            msg = "Tidak ada data untuk dibuat PDF."
+            msg = "Tidak ada catatan pengeluaran." if ledger_cache.loaded else BACKEND_DOWN_MESSAGE
             await update.message.reply_text(msg)
             log_sent(msg, update.effective_user.id)
             return
 
-        # Check for month/year filter parameter
-        month_filter = None
-        year_filter = None
-        if context.args:
-            try:
-                month_filter, year_filter = map(int, context.args[0].split('/'))
-                if not (1 <= month_filter <= 12 and 2000 <= year_filter <= 2100):
-                    await update.message.reply_text("Format bulan/tahun tidak valid. Gunakan: /pdf MM/YYYY (contoh: /pdf 04/2025)")
-                    return
-            except:
-                await update.message.reply_text("Format tidak valid. Gunakan: /pdf MM/YYYY (contoh: /pdf 04/2025)")
-                return
+        # Total rentang dari prefix sum total harian; delta sync hanya menambah hari yang baru
+        date_index.update(data)
+        msg = rolling_report(date_index, today) if start is None else range_report(date_index, start, end)
+        await update.message.reply_text(msg)
+        log_sent(msg, update.effective_user.id)
 
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                              rightMargin=2*cm, leftMargin=2*cm, 
-                              topMargin=2*cm, bottomMargin=2*cm)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            name='TitleStyle',
-            parent=styles['Title'],
-            fontSize=14,
-            alignment=TA_CENTER,
-            spaceAfter=20
-        )
-        
-        wrap_style = ParagraphStyle(
-            name='wrap_style',
-            parent=styles['Normal'],
-            alignment=TA_LEFT,
-            wordWrap='CJK',
-            fontSize=8,
+    except httpx.HTTPError as e:
+        msg = f"Gagal mengambil data: {str(e)}"
+        await update.message.reply_text(msg)
+        log_sent(msg, update.effective_user.id)
+
+async def cari(update: Update, context: CallbackContext) -> None:
+    """Search expenses by keterangan/kategori words (prefix match) and show totals"""
+    log_received(update)
+    log_command("/cari", update.effective_user.id)
+    if not await allow_request(update, "cari"):
+        return
+
+    query = " ".join(context.args or []).strip()
+    if not query or any(len(term) < SearchIndex.MIN_PREFIX for term in tokenize(query)):
+        await update.message.reply_text(
+            "Gunakan: /cari <kata> (minimal 2 huruf per kata)\n"
+            "Contoh: `/cari kopi` atau `/cari makan siang`",
+            parse_mode="Markdown"
         )
-        
-        center_style = ParagraphStyle(
-            name='center_style',
-            parent=styles['Normal'],
-            alignment=TA_CENTER,
-            fontSize=8,
+        return
+
+    try:
+        data = await get_cached_data()
+        if not data:
+            msg = "Tidak ada catatan pengeluaran." if ledger_cache.loaded else BACKEND_DOWN_MESSAGE
+            await update.message.reply_text(msg)
+            log_sent(msg, update.effective_user.id)
+            return
+
+        search_index.update(data)
+        positions = search_index.search(query)
+        if not positions:
+            msg = f"Tidak ditemukan catatan untuk \"{query}\"."
+            await update.message.reply_text(msg)
+            log_sent(msg, update.effective_user.id)
+            return
+
+        total = 0
+        categories = {}  # kategori ternormalisasi -> [nama, total]
+        for position in positions:
+            item = data[position]
+            total += item.amount
+            categories.setdefault(item.category, [item.kategori.capitalize(), 0])[1] += item.amount
+
+        lines = [
+            f"🔍 Hasil pencarian \"{query}\": {len(positions)} catatan",
+            f"Total: {format_rupiah(total)}",
+            "",
+        ]
+        for position in positions[:15]:
+            item = data[position]
+            lines.append(f"{item.tanggal or '-'} • {item.kategori} • {format_rupiah(item.amount)} • {item.keterangan[:80]}")
+        if len(positions) > 15:
+            lines.append(f"... dan {len(positions) - 15} catatan lainnya")
+        if len(categories) > 1:
+            lines.append("")
+            lines.append("Per kategori:")
+            top = sorted(categories.values(), key=lambda x: x[1], reverse=True)[:5]
+            lines.extend(f"• {name}: {format_rupiah(amount)}" for name, amount in top)
+
+        msg = "\n".join(lines)
+        await update.message.reply_text(msg)
+        log_sent(msg, update.effective_user.id)
+
+    except httpx.HTTPError as e:
+        msg = f"Gagal mengambil data: {str(e)}"
+        await update.message.reply_text(msg)
+        log_sent(msg, update.effective_user.id)
+
+async def budget(update: Update, context: CallbackContext) -> None:
+    """Show monthly budgets, or set one with /budget <kategori> <nominal>"""
+    log_received(update)
+    log_command("/budget", update.effective_user.id)
+    if not await allow_request(update, "budget"):
+        return
+
+    args = context.args or []
+    try:
+        if len(args) == 1:
+            raise ValueError("Nominal belum diisi")
+        if args:
+            nominal = re.sub(r"[^\d]", "", args[-1])
+            if not nominal.isdigit():
+                raise ValueError("Nominal harus berupa angka")
+            kategori = " ".join(args[:-1])
+            await budget_book.set(kategori, int(nominal))
+            if int(nominal):
+                msg = f"✅ Budget {kategori.strip()} diatur {format_rupiah(int(nominal))} per bulan"
+            else:
+                msg = f"🗑 Budget {kategori.strip()} dihapus"
+            await update.message.reply_text(msg)
+            log_sent(msg, update.effective_user.id)
+            return
+    except ValueError:
+        await update.message.reply_text(
+            "Gunakan: /budget <kategori> <nominal>\n"
+            "Contoh: /budget Makanan 1.500.000\n"
+            "Nominal 0 menghapus budget, /budget saja menampilkan semua budget."
         )
+        return
+    except sqlite3.Error as e:
+        logger.error(f"Failed to save budget: {e}")
+        await update.message.reply_text("⚠️ Gagal menyimpan budget, silakan coba lagi")
+        return
 
-        # Chart generation functions
-        def generate_monthly_chart(month_data, year, month):
-            import matplotlib.dates as mdates
-            daily_totals = defaultdict(float)
-            month_name = get_month_name(month)
-            
-            for item in month_data:
-                tanggal = item.get("tanggal", "").strip()
-                nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-                nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-                if nominal > 0:
-                    daily_totals[tanggal] += nominal
-
-            sorted_data = sorted(daily_totals.items(), key=lambda x: datetime.strptime(x[0], "%d-%m-%Y"))
-            dates = [datetime.strptime(tgl, "%d-%m-%Y") for tgl, _ in sorted_data]
-            amounts = [jumlah for _, jumlah in sorted_data]
-
-            fig, ax = plt.subplots(figsize=(14, 6))
-            bars = ax.bar(dates, amounts, color="#4285F4")
-
-            for bar, amount in zip(bars, amounts):
-                ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(), 
-                       f"Rp{int(amount):,}".replace(",", "."),
-                       ha='center', va='bottom', fontsize=8)
-
-            ax.set_ylabel("Nominal", fontsize=9)
-            ax.set_title(f"Pengeluaran Harian", fontsize=10)
-            ax.tick_params(axis='x', rotation=45, labelsize=8)
-            ax.tick_params(axis='y', labelsize=8)
-            ax.set_ylim(0, max(amounts)*1.2 if amounts else 1)
-
-            ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
-
-            fig.tight_layout()
-            chart_buffer = BytesIO()
-            plt.savefig(chart_buffer, format='png', dpi=120, bbox_inches='tight')
-            chart_buffer.seek(0)
-            plt.close(fig)
-            return chart_buffer
-
-        def generate_category_chart(month_data, year, month):
-            categories = defaultdict(float)
-            original_names = {}
-            
-            for item in month_data:
-                original_kategori = item.get("kategori", "Lainnya").strip()
-                normalized_kategori = normalize_category(original_kategori)
-                nominal_raw = str(item.get("nominal", "0")).replace(".", "").replace(",", "").strip()
-                nominal = float(nominal_raw) if nominal_raw else 0
-                categories[normalized_kategori] += nominal
-                
-                if normalized_kategori not in original_names:
-                    original_names[normalized_kategori] = original_kategori
-
-            fig, ax = plt.subplots(figsize=(8, 8))
-            colors = plt.cm.Pastel1(range(len(categories)))
-            
-            def make_autopct(values):
-                def my_autopct(pct):
-                    total = sum(values)
-                    val = int(round(pct*total/100.0))
-                    return f"{pct:.1f}%\n(Rp {val:,})".replace(",", ".")
-                return my_autopct
-            
-            wedges, texts, autotexts = ax.pie(
-                categories.values(),
-                labels=[original_names[k].capitalize() for k in categories.keys()],
-                autopct=make_autopct(categories.values()),
-                startangle=90,
-                colors=colors,
-                textprops={'fontsize': 7},
-                pctdistance=0.85,
-                labeldistance=1.05
-            )
-            
-            ax.set_title(f"Distribusi Kategori", fontsize=10, pad=20)
-            plt.setp(autotexts, size=8, weight="bold")
-            plt.tight_layout()
-
-            buf = BytesIO()
-            plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            return buf
-
-        def generate_top_categories_chart(month_data, year, month):
-            categories = defaultdict(float)
-            original_names = {}
-            
-            for item in month_data:
-                original_kategori = item.get("kategori", "Lainnya").strip()
-                normalized_kategori = normalize_category(original_kategori)
-                nominal_raw = str(item.get("nominal", "0")).replace(".", "").replace(",", "").strip()
-                nominal = float(nominal_raw) if nominal_raw else 0
-                categories[normalized_kategori] += nominal
-                
-                if normalized_kategori not in original_names:
-                    original_names[normalized_kategori] = original_kategori
-
-            top5 = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:5]
-            
-            fig, ax = plt.subplots(figsize=(12, 5))
-            colors = plt.cm.Blues(np.linspace(0.5, 1, len(top5)))
-            
-            bars = ax.barh(
-                [original_names[k].capitalize() for k, v in top5],
-                [v for k, v in top5],
-                color=colors
-            )
-            
-            ax.bar_label(bars, 
-                        labels=[f"Rp {int(v):,}".replace(",", ".") for k, v in top5],
-                        padding=5,
-                        fontsize=8)
-            
-            ax.set_title(f"Top 5 Kategori", fontsize=10)
-            ax.tick_params(axis='both', labelsize=8)
-            ax.invert_yaxis()
-            plt.tight_layout()
-
-            buf = BytesIO()
-            plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            return buf
-
-        # Group data by month with new data check
-        monthly_data = defaultdict(list)
-        monthly_totals = defaultdict(float)
+    if not budget_book.budgets:
+        await update.message.reply_text("Belum ada budget. Atur dengan /budget <kategori> <nominal>")
+        return
+
+    # Pastikan rollup bulan ini mengikuti data terbaru
+    await get_cached_data()
+    now = datetime.now(SHEET_TIMEZONE)
+    lines = [f"💰 BUDGET {get_month_name(now.month).upper()} {now.year}", ""]
+    for category, (name, limit) in sorted(budget_book.budgets.items()):
+        spent = budget_book.spent(category, now.year, now.month)
+        mark = "🚨" if spent >= limit else "⚠️" if spent >= BUDGET_THRESHOLDS[0] * limit else "✅"
+        lines.append(f"{mark} {name}: {format_rupiah(spent)} / {format_rupiah(limit)} ({spent * 100 // limit}%)")
+    msg = "\n".join(lines)
+    await update.message.reply_text(msg)
+    log_sent(msg, update.effective_user.id)
+
+async def kirim_pdf(update: Update, context: CallbackContext) -> None:
+    log_received(update)
+    log_command("/pdf", update.effective_user.id)
+    if not await allow_request(update, "pdf"):
+        return
+
+    try:
+        # Tanpa argumen: seluruh riwayat; dengan periode: hanya bulan dalam periode itu
+        try:
+            period = parse_period(context.args, None)
+        except ValueError:
+            await update.message.reply_text(period_usage("pdf"))
+            return
+
+        data = await get_cached_data()
         
-        for item in data:
-            tanggal = item.get("tanggal", "")
-            if tanggal:
-                try:
-                    day, month, year = map(int, tanggal.split('-'))
-                    nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-                    nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-                    
-                    # Always include all valid data (removed filtering conditions)
-                    monthly_data[(year, month)].append(item)
-                    monthly_totals[(year, month)] += nominal
-                except Exception as e:
-                    logger.error(f"Error processing item: {item} - {str(e)}")
-                    continue
-
-        if not monthly_data:
+        if not data:
+            msg = "Tidak ada data untuk dibuat PDF." if ledger_cache.loaded else BACKEND_DOWN_MESSAGE
+            await update.message.reply_text(msg)
+            log_sent(msg, update.effective_user.id)
+            return
+
+        # Monthly rollups from the analytics engine, limited to the requested period
+        analytics = get_analytics(data)
+        if period:
+            monthly_totals = analytics.monthly_totals(period.start, period.end)
+        else:
+            monthly_totals = analytics.monthly_totals()
+
+        if not monthly_totals:
             msg = "Tidak ada data yang sesuai dengan filter."
             await update.message.reply_text(msg)
             log_sent(msg, update.effective_user.id)
             return
 
-        sorted_months = sorted(monthly_data.keys())
-
-        # Create report for each month
-        for year, month in sorted_months:
-            month_name = get_month_name(month)
-            month_data = monthly_data[(year, month)]
-            
-            # Month title
-            elements.append(Paragraph(f"LAPORAN PENGELUARAN {month_name.upper()} {year}", title_style))
-            elements.append(Spacer(1, 12))
-
-            # Transactions table
-            table_data = [["NO", "Tanggal", "Kategori", "Nominal", "Keterangan"]]
-            month_total = 0
-
-            for i, item in enumerate(month_data, 1):
-                nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-                nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-                month_total += nominal
-                table_data.append([
-                    Paragraph(str(i), center_style),
-                    Paragraph(item.get("tanggal", "-"), wrap_style),
-                    Paragraph(item.get("kategori", "-"), wrap_style),
-                    Paragraph(f"Rp {int(nominal):,}".replace(",", "."), wrap_style),
-                    Paragraph(item.get("keterangan", "-"), wrap_style)
-                ])
-
-            col_widths = [1.5*cm, 2.5*cm, 3*cm, 2.5*cm, 6*cm]
-            table = Table(table_data, repeatRows=1, colWidths=col_widths)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#4285F4")),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0,0), (-1,-1), 8),
-                ('ALIGN', (0,0), (-1,0), 'CENTER'),
-                ('VALIGN', (0,0), (-1,0), 'MIDDLE'),
-                ('ALIGN', (3,1), (3,-1), 'RIGHT'),
-                ('VALIGN', (0,1), (-1,-1), 'TOP'),
-            ]))
-
-            elements.append(table)
-            elements.append(Spacer(1, 12))
-            elements.append(Paragraph(
-                f"<b>TOTAL PENGELUARAN {month_name.upper()} {year}:</b> Rp {int(month_total):,}".replace(",", "."), 
-                styles["Heading3"]
-            ))
+        sorted_months = sorted(monthly_totals.keys())
 
-            # Highest spending date analysis
-            daily_totals = defaultdict(float)
-            daily_items = defaultdict(list)
-
-            for item in month_data:
-                tgl = item.get("tanggal", "").strip()
-                nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-                nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-                daily_totals[tgl] += nominal
-                daily_items[tgl].append(item)
-
-            if daily_totals:
-                tanggal_terbanyak = max(daily_totals, key=daily_totals.get)
-                jumlah_terbanyak = daily_totals[tanggal_terbanyak]
-
-                transaksi_detail = []
-                for item in daily_items[tanggal_terbanyak]:
-                    kategori = item.get("kategori", "Lainnya").strip()
-                    nominal_raw = str(item.get("nominal", "")).replace(".", "").replace(",", "").strip()
-                    nominal = float(nominal_raw) if nominal_raw.isdigit() else 0
-                    keterangan = item.get("keterangan", "-")
-                    transaksi_detail.append({
-                        'kategori': kategori,
-                        'nominal': nominal,
-                        'keterangan': keterangan
-                    })
-
-                elements.append(Spacer(1, 12))
-                elements.append(Paragraph(
-                    f"<b>Pengeluaran tertinggi pada bulan {month_name} terjadi pada tanggal {tanggal_terbanyak} dengan total sebesar:</b> Rp {int(jumlah_terbanyak):,}".replace(",", "."),
-                    styles["Normal"]
-                ))
-
-                elements.append(Spacer(1, 6))
-                elements.append(Paragraph(f"<b>Berikut rincian pengeluarannya:</b>", styles["Normal"]))
-
-                for i, transaksi in enumerate(transaksi_detail, 1):
-                    elements.append(Paragraph(
-                        f"{i}. Kategori: {transaksi['kategori']}<br/>"
-                        f"&nbsp;&nbsp;&nbsp;&nbsp;Total: Rp {int(transaksi['nominal']):,}<br/>"
-                        f"&nbsp;&nbsp;&nbsp;&nbsp;Keterangan: {transaksi['keterangan']}".replace(",", "."),
-                        styles["Normal"]
-                    ))
-                    elements.append(Spacer(1, 6))
-
-            # Move charts to new page
-            elements.append(PageBreak())
-            elements.append(Paragraph(f"ANALISIS PENGELUARAN {month_name.upper()} {year}", title_style))
-            elements.append(Spacer(1, 12))
-
-            # Daily chart
-            daily_chart = generate_monthly_chart(month_data, year, month)
-            elements.append(RLImage(daily_chart, width=15*cm, height=7*cm))
-            elements.append(Spacer(1, 0.5*cm))
-            
-            # Category pie chart
-            category_chart = generate_category_chart(month_data, year, month)
-            elements.append(RLImage(category_chart, width=10*cm, height=10*cm))
-            elements.append(Spacer(1, 0.5*cm))
-            
-            # Top categories chart
-            top_categories_chart = generate_top_categories_chart(month_data, year, month)
-            elements.append(RLImage(top_categories_chart, width=15*cm, height=5*cm))
-
-            if (year, month) != sorted_months[-1]:
-                elements.append(PageBreak())
-
-        # Monthly comparison for multi-month reports
-        if len(sorted_months) > 1 and not month_filter:
-            elements.append(PageBreak())
-            elements.append(Paragraph("PERBANDINGAN BULANAN", title_style))
-            elements.append(Spacer(1, 12))
-            
-            months = [f"{get_month_name(m)} {y}" for y, m in sorted_months]
-            amounts = [monthly_totals[(y, m)] for y, m in sorted_months]
-
-            fig, ax = plt.subplots(figsize=(14, 6))
-            bars = ax.bar(months, amounts, color="#34A853")
-
-            for bar, amount in zip(bars, amounts):
-                ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(), 
-                       f"Rp{int(amount):,}".replace(",", "."),
-                       ha='center', va='bottom', fontsize=8)
-
-            ax.set_title("Perbandingan Pengeluaran Bulanan", fontsize=10)
-            ax.tick_params(axis='x', rotation=45, labelsize=8)
-            ax.set_ylim(0, max(amounts)*1.2 if amounts else 1)
-            plt.tight_layout()
-
-            chart_buffer = BytesIO()
-            plt.savefig(chart_buffer, format='png', dpi=120, bbox_inches='tight')
-            chart_buffer.seek(0)
-            plt.close(fig)
-            
-            elements.append(RLImage(chart_buffer, width=15*cm, height=7*cm))
-
-        doc.build(elements)
-        buffer.seek(0)
+        async with render_slot(update):
+            # Section per bulan dibangun paralel; bulan yang tidak berubah diambil dari cache
+            sections = await asyncio.gather(
+                *(get_report_section(analytics, year, month) for year, month in sorted_months)
+            )
 
-        caption = "Laporan pengeluaran lengkap"
-        if month_filter:
-            caption += f" untuk {get_month_name(month_filter)} {year_filter}"
-        
-        await update.message.reply_document(
-            document=buffer,
-            filename="laporan_pengeluaran.pdf",
-            caption=caption
-        )
-        log_sent(f"Mengirim laporan PDF {caption}", update.effective_user.id)
+            styles = report_styles()
+
+            # Monthly comparison for multi-month reports
+            comparison_chart = None
+            if len(sorted_months) > 1:
+                months = [f"{get_month_name(m)} {y}" for y, m in sorted_months]
+                amounts = [monthly_totals[(y, m)] for y, m in sorted_months]
+
+                chart_buffer = await render_chart(render_monthly_comparison, months, amounts)
+                comparison_chart = chart_buffer.getvalue()
+
+            caption = "Laporan pengeluaran lengkap"
+            if period:
+                caption += f" untuk {period.label}"
+
+            # Estimasi sedikit di atas ukuran sebenarnya; sisa 10% sebagai cadangan sehingga
+            # dokumen tunggal tidak perlu dibangun dulu hanya untuk dibuang karena kebesaran
+            buffer = None
+            if estimate_report_bytes(sections) <= TELEGRAM_DOCUMENT_LIMIT * 9 // 10:
+                elements = []
+                for section in sections:
+                    elements.extend(section_flowables(section, await section_charts(section), styles))
+                    if (section.year, section.month) != sorted_months[-1]:
+                        elements.append(PageBreak())
+                if comparison_chart:
+                    elements.append(PageBreak())
+                    elements.extend(comparison_flowables(comparison_chart, styles))
+
+                buffer = await asyncio.to_thread(build_pdf, elements)
+            else:
+                # Laporan terlalu besar untuk satu dokumen: satu PDF per bulan, dikirim dalam zip.
+                # Setiap bagian dikirim begitu bagian berikutnya dimulai (atau laporan selesai),
+                # jadi paling banyak dua bagian yang tertahan di memori.
+                count, previous = 0, None
+                async for part in build_split_report(sections, styles, comparison_chart):
+                    if previous is not None:
+                        await send_document(
+                            update,
+                            previous,
+                            filename=f"laporan_pengeluaran_{count}.zip",
+                            caption=f"{caption} (bagian {count})"
+                        )
+                    count += 1
+                    previous = part
+                await send_document(
+                    update,
+                    previous,
+                    filename=f"laporan_pengeluaran_{count}.zip",
+                    caption=caption if count == 1 else f"{caption} (bagian {count}, terakhir)"
+                )
+                log_sent(f"Mengirim laporan PDF {caption} dalam {count} zip", update.effective_user.id)
+
+        # Upload di luar slot render agar upload yang lambat tidak menahan grafik user lain
+        if buffer is not None:
+            await send_document(
+                update,
+                buffer,
+                filename=f"laporan_pengeluaran_{period.slug}.pdf" if period else "laporan_pengeluaran.pdf",
+                caption=caption
+            )
+            log_sent(f"Mengirim laporan PDF {caption}", update.effective_user.id)
 
     except Exception as e:
         logger.error(f"Error in kirim_pdf: {str(e)}", exc_info=True)
         await update.message.reply_text(f"⚠️ Gagal membuat PDF: {str(e)}")
 
+# ===== Lifecycle =====
+async def startup(app: Application) -> None:
+    """Start background resources and load the local ledger mirror"""
+    start_chart_pool()
+    await load_local_ledger(app)
+    try:
+        await budget_book.load()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to load budgets: {e}")
+    try:
+        write_queue.restore()
+    except OSError as e:
+        logger.error(f"Failed to read write journal: {e}")
+    write_queue.start()
+
+async def shutdown(app: Application) -> None:
+    """Release network, storage and worker resources when the bot stops"""
+    await write_queue.stop()
+    await close_http_client()
+    ledger_store.close()
+    stop_chart_pool()
+
 # ===== Error Handler =====
 async def error_handler(update: object, context: CallbackContext) -> None:
     """Handle errors"""
@@ -974,7 +3213,7 @@ async def error_handler(update: object, context: CallbackContext) -> None:
     try:
         if isinstance(context.error, NetworkError):
             await update.message.reply_text("⚠️ Terjadi masalah koneksi, silakan coba lagi nanti")
-        elif isinstance(context.error, requests.exceptions.Timeout):
+        elif isinstance(context.error, httpx.TimeoutException):
             await update.message.reply_text("⏱ Waktu koneksi habis, silakan coba lagi")
         elif isinstance(context.error, BadRequest):
             if "Message is too long" in str(context.error):
@@ -992,7 +3231,13 @@ def main():
     logger.info("Starting bot...")
     print("Bot is running.")
 
-    app = Application.builder().token(TOKEN).build()
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(startup)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Error handler
     app.add_error_handler(error_handler)
@@ -1005,11 +3250,16 @@ def main():
     app.add_handler(CommandHandler("grafik", kirim_grafik))
     app.add_handler(CommandHandler("kategori", kategori_pie))
     app.add_handler(CommandHandler("topkategori", top_kategori))
+    app.add_handler(CommandHandler("range", rentang_tanggal))
+    app.add_handler(CommandHandler("cari", cari))
+    app.add_handler(CommandHandler("budget", budget))
+    app.add_handler(CallbackQueryHandler(info_navigation, pattern=r"^info:"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     # Job queues
     job_queue = app.job_queue
     if job_queue:
+        job_queue.run_repeating(probe_backend, interval=HEALTH_CHECK_INTERVAL, first=1)  # Apps Script health
         job_queue.run_repeating(backup_data, interval=86400, first=10)  # Backup daily
         job_queue.run_repeating(check_updates, interval=86400, first=60)  # Check updates daily
 
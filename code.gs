@@ -1,6 +1,11 @@
 function doPost(e) {
     var sheet = SpreadsheetApp.openById("isi dengan id Spreadsheet").getSheetByName("Sheet1");
     var data = JSON.parse(e.postData.contents);
+
+    // Mode batch: {"rows": [...]} dari antrean tulis bot
+    if (Array.isArray(data.rows)) {
+        return saveRows(sheet, data.rows);
+    }
     
     var waktu = new Date();
     var tanggal = Utilities.formatDate(waktu, "GMT+7", "dd-MM-yyyy"); // Format tanggal
@@ -25,12 +30,24 @@ function doPost(e) {
 
 function doGet(e) {
   var action = e.parameter.action;
+  var columnar = e.parameter.format === "columnar";
   if (action === "getData") {
-    return getData();
+    if (e.parameter.since !== undefined) {
+      return getDataSince(Number(e.parameter.since), e.parameter.token || "", columnar);
+    }
+    return getData(columnar);
+  }
+  if (action === "summary") {
+    return getSummary(Number(e.parameter.month), Number(e.parameter.year));
+  }
+  if (action === "ping") {
+    // Dipakai bot untuk memantau koneksi; tidak membuka spreadsheet
+    return ContentService.createTextOutput(JSON.stringify({ok: true}))
+                         .setMimeType(ContentService.MimeType.JSON);
   }
 }
 
-function getData() {
+function getData(columnar) {
   var sheet = SpreadsheetApp.openById("id_spreadsheet").getSheetByName("Sheet1");
   var data = sheet.getDataRange().getValues();
   
@@ -45,6 +62,181 @@ function getData() {
     });
   }
   
+  return ContentService.createTextOutput(JSON.stringify(encodeRows(result, columnar)))
+                       .setMimeType(ContentService.MimeType.JSON);
+}
+
+// Token = digest isi semua baris yang sudah dimiliki bot (baris 1..since).
+// Dihitung di server, jadi edit/hapus di baris mana pun membuat token tidak cocok
+// dan bot resync penuh, tanpa perlu mengirim ulang seluruh sheet setiap kali.
+function rowsToken(rows) {
+  var digest = Utilities.computeDigest(Utilities.DigestAlgorithm.MD5, JSON.stringify(rows));
+  return Utilities.base64EncodeWebSafe(digest);
+}
+
+// Format kolom (format=columnar): satu array per kolom, nominal berupa angka,
+// kategori di-encode sebagai indeks ke daftar nama kategori unik.
+// Jauh lebih kecil daripada array objek yang mengulang nama key di setiap baris.
+function encodeRows(rows, columnar) {
+  if (!columnar) {
+    return rows;
+  }
+  var result = {format: "columnar", tanggal: [], nominal: [], kategori: [], kategori_names: [], keterangan: []};
+  var index = {};
+  for (var i = 0; i < rows.length; i++) {
+    var kategori = String(rows[i].kategori === undefined ? "" : rows[i].kategori);
+    if (!(kategori in index)) {
+      index[kategori] = result.kategori_names.length;
+      result.kategori_names.push(kategori);
+    }
+    result.tanggal.push(rows[i].tanggal);
+    result.nominal.push(toAmount(rows[i].nominal));
+    result.kategori.push(index[kategori]);
+    result.keterangan.push(rows[i].keterangan);
+  }
+  return result;
+}
+
+function formatRow(row) {
+  return {
+    tanggal: Utilities.formatDate(new Date(row[0]), "GMT+7", "dd-MM-yyyy"),
+    nominal: row[1],
+    kategori: row[2],
+    keterangan: row[3]
+  };
+}
+
+// Delta sync: hanya kirim baris yang ditambahkan setelah baris ke-`since` (tanpa header).
+// Sheet tetap dibaca utuh di server untuk token, tapi yang dikirim ke bot hanya baris baru.
+function getDataSince(since, token, columnar) {
+  var sheet = SpreadsheetApp.openById("id_spreadsheet").getSheetByName("Sheet1");
+  var total = sheet.getLastRow() - 1;  // jumlah baris data (tanpa header)
+  var values = total > 0 ? sheet.getRange(2, 1, total, 4).getValues() : [];
+  var full = false;
+
+  if (!(since >= 0) || since > total) {
+    full = true;
+  } else if (since > 0) {
+    full = rowsToken(values.slice(0, since)) !== token;
+  }
+  if (full) {
+    since = 0;
+  }
+
+  var rows = [];
+  for (var i = since; i < total; i++) {
+    rows.push(formatRow(values[i]));
+  }
+
+  var newToken = token;
+  if (total > since) {
+    newToken = rowsToken(values);
+  } else if (full) {
+    newToken = "";
+  }
+
+  var result = {full: full, cursor: total, token: newToken, rows: encodeRows(rows, columnar)};
+  return ContentService.createTextOutput(JSON.stringify(result))
+                       .setMimeType(ContentService.MimeType.JSON);
+}
+
+// Nominal bisa berupa angka atau teks "50.000"; samakan dengan parsing di bot
+function toAmount(value) {
+  if (typeof value === "number") {
+    return value;
+  }
+  var amount = parseInt(String(value).replace(/[.,\s]/g, ""), 10);
+  return isNaN(amount) ? 0 : amount;
+}
+
+// Baris data (tanpa header) untuk satu bulan, beserta tanggal terformat
+function getMonthRows(month, year) {
+  var sheet = SpreadsheetApp.openById("id_spreadsheet").getSheetByName("Sheet1");
+  var data = sheet.getDataRange().getValues();
+
+  var result = [];
+  for (var i = 1; i < data.length; i++) {
+    var tanggal = Utilities.formatDate(new Date(data[i][0]), "GMT+7", "dd-MM-yyyy");
+    var parts = tanggal.split("-");
+    if (Number(parts[1]) === month && Number(parts[2]) === year) {
+      result.push({row: data[i], tanggal: tanggal});
+    }
+  }
+  return result;
+}
+
+// Total per hari dan per kategori untuk satu bulan (tanpa mengirim baris mentah)
+function getSummary(month, year) {
+  var rows = getMonthRows(month, year);
+  var daily = {};
+  var categories = {};
+  var total = 0;
+
+  for (var i = 0; i < rows.length; i++) {
+    var amount = toAmount(rows[i].row[1]);
+    var name = String(rows[i].row[2] || "Lainnya").trim();
+    var key = name.toLowerCase();
+
+    total += amount;
+    if (amount > 0) {
+      daily[rows[i].tanggal] = (daily[rows[i].tanggal] || 0) + amount;
+    }
+    if (!categories[key]) {
+      categories[key] = {name: name, total: 0};
+    }
+    categories[key].total += amount;
+  }
+
+  var result = {month: month, year: year, count: rows.length, total: total,
+                daily: daily, categories: categories};
+  return ContentService.createTextOutput(JSON.stringify(result))
+                       .setMimeType(ContentService.MimeType.JSON);
+}
+
+var RECENT_IDS_KEY = "recentWriteIds";
+var RECENT_IDS_MAX = 200;   // id terakhir yang disimpan permanen di Script Properties
+var WRITE_ID_TTL = 21600;   // 6 jam, batas maksimum CacheService
+
+// Simpan banyak baris sekaligus dengan satu setValues (mode batch).
+// Baris dengan id yang sudah pernah disimpan (kiriman ulang dari bot) dilewati.
+function saveRows(sheet, rows) {
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    var cache = CacheService.getScriptCache();
+    var props = PropertiesService.getScriptProperties();
+    var recent = JSON.parse(props.getProperty(RECENT_IDS_KEY) || "[]");
+    var keys = rows.filter(function(row) { return row.id; })
+                   .map(function(row) { return "write:" + row.id; });
+    var cached = keys.length > 0 ? cache.getAll(keys) : {};
+
+    var values = [];
+    var saved = {};
+    for (var i = 0; i < rows.length; i++) {
+      var row = rows[i];
+      if (row.id) {
+        var key = "write:" + row.id;
+        if (cached[key] || saved[key] || recent.indexOf(row.id) !== -1) {
+          continue;
+        }
+        saved[key] = "1";
+        recent.push(row.id);
+      }
+      values.push([row.waktu ? new Date(row.waktu) : new Date(), row.nominal, row.kategori, row.keterangan]);
+    }
+
+    if (values.length > 0) {
+      sheet.getRange(sheet.getLastRow() + 1, 1, values.length, 4).setValues(values);
+    }
+    if (Object.keys(saved).length > 0) {
+      cache.putAll(saved, WRITE_ID_TTL);
+      props.setProperty(RECENT_IDS_KEY, JSON.stringify(recent.slice(-RECENT_IDS_MAX)));
+    }
+  } finally {
+    lock.releaseLock();
+  }
+
+  var result = {saved: values.length, duplicates: rows.length - values.length};
   return ContentService.createTextOutput(JSON.stringify(result))
                        .setMimeType(ContentService.MimeType.JSON);
 }
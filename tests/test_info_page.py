@@ -0,0 +1,22 @@
+import re
+
+import bot2
+from bot2 import Expense, LedgerRows
+
+
+def test_info_page_escapes_markdown_and_fits_one_message():
+    records = LedgerRows(
+        [Expense("01-03-2025", 1000, "kopi_susu*" + "x" * 5000, "pakai [promo] `kode`_" * 50)
+         for _ in range(bot2.INFO_PAGE_SIZE)]
+    )
+    text, keyboard = bot2.render_info_page(records, len(records), 0)
+
+    assert len(text) <= 4096
+    body = text.split("\n", 1)[1].rsplit("\n", 1)[0]  # tanpa judul/total yang memang bold
+    assert not re.search(r"(?<!\\)[_*`\[]", body)
+    assert keyboard is None
+
+
+def test_info_field_does_not_leave_a_dangling_escape():
+    assert bot2.info_field("ab_cd", 3) == "ab…"
+    assert bot2.info_field("", 10) == "-"
@@ -0,0 +1,59 @@
+import random
+
+import bot2
+from bot2 import Expense, LedgerRows
+
+
+def random_record(rng):
+    tanggal = "%02d-%02d-%d" % (rng.randint(1, 28), rng.randint(1, 12), rng.choice([2024, 2025]))
+    return Expense(tanggal if rng.random() > 0.05 else "bukan tanggal", rng.randint(-5, 100),
+                   rng.choice(["Makan", "makan ", "Bensin", "Kopi"]), rng.choice(["kopi susu", "makan siang", "-"]))
+
+
+def grow(rng, generation=0, rounds=15):
+    """Successive snapshots of one generation, each appending rows to the previous one"""
+    records = LedgerRows([random_record(rng) for _ in range(100)], generation)
+    yield records
+    for _ in range(rounds):
+        records = LedgerRows(records, generation)
+        records.extend(random_record(rng) for _ in range(rng.randint(0, 20)))
+        yield records
+
+
+def test_extends_requires_same_generation():
+    rows = LedgerRows([Expense("01-03-2025", 1, "a", "b")], 1)
+    longer = LedgerRows(rows, 1)
+    longer.append(Expense("02-03-2025", 1, "a", "b"))
+    assert longer.extends(rows)
+    assert not rows.extends(longer)
+    assert not LedgerRows(longer, 2).extends(rows)
+
+
+def test_incremental_analytics_matches_rebuild(monkeypatch):
+    monkeypatch.setattr(bot2, "_analytics", None)
+    for records in grow(random.Random(1)):
+        incremental = bot2.get_analytics(records)
+        fresh = bot2.LedgerAnalytics(records)
+        assert incremental.monthly_totals() == fresh.monthly_totals()
+        for year in (2024, 2025):
+            for month in range(1, 13):
+                assert incremental.month_records(year, month) == fresh.month_records(year, month)
+                assert incremental.category_totals(year, month) == fresh.category_totals(year, month)
+
+
+def test_incremental_indexes_match_rebuild():
+    rng = random.Random(2)
+    dates, search = bot2.DateIndex(), bot2.SearchIndex()
+    snapshots = list(grow(rng)) + list(grow(rng, generation=1, rounds=3))
+    for records in snapshots:
+        dates.update(records)
+        search.update(records)
+        fresh_dates, fresh_search = bot2.DateIndex(), bot2.SearchIndex()
+        fresh_dates.update(records)
+        fresh_search.update(records)
+
+        start, end = Expense("01-01-2024", 0, "", "").ordinal, Expense("31-12-2025", 0, "", "").ordinal
+        assert dates.range_total(start, end) == fresh_dates.range_total(start, end)
+        assert dates.range_categories(start, end) == fresh_dates.range_categories(start, end)
+        for query in ("kopi", "mak", "makan siang"):
+            assert search.search(query) == fresh_search.search(query)
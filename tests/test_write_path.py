@@ -0,0 +1,208 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import bot2
+
+
+class FakeStore:
+    """LedgerStore stand-in: the SQLite mirror is not under test here"""
+
+    async def replace_all(self, records, cursor, token):
+        pass
+
+    async def append(self, records, first_row, cursor, token):
+        pass
+
+
+def row(tanggal, nominal, kategori="Makan", keterangan="-"):
+    return {"tanggal": tanggal, "nominal": nominal, "kategori": kategori, "keterangan": keterangan}
+
+
+def payload(nominal, kategori="Makan", keterangan="-", waktu=1740787200000):  # 01-03-2025 07:00 GMT+7
+    return {"waktu": waktu, "nominal": str(nominal), "kategori": kategori, "keterangan": keterangan}
+
+
+def month_total(sync, year=2025, month=3):
+    return sync.rollups.summary(year, month).get("total", 0)
+
+
+@pytest.fixture
+def sync(monkeypatch):
+    ledger_sync = bot2.LedgerSync(FakeStore())
+    monkeypatch.setattr(bot2, "ledger_sync", ledger_sync)
+    return ledger_sync
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """Queue of Apps Script replies; GET and POST both take the next one"""
+    queue = []
+
+    async def reply(*args, **kwargs):
+        item = queue.pop(0)
+        if isinstance(item, BaseException):
+            raise item
+        if callable(item):
+            item = item()
+        return item if isinstance(item, httpx.Response) else httpx.Response(200, json=item)
+
+    monkeypatch.setattr(bot2, "script_get", reply)
+    monkeypatch.setattr(bot2, "script_post", reply)
+    return queue
+
+
+def write_journal(path, lines):
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def add_line(write_id, nominal=1000):
+    return json.dumps({"op": "add", "row": dict(payload(nominal), id=write_id)}) + "\n"
+
+
+def ack_line(*ids):
+    return json.dumps({"op": "ack", "ids": list(ids)}) + "\n"
+
+
+# ===== WriteJournal =====
+def test_journal_replay_ignores_torn_last_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [add_line("a"), add_line("b"), ack_line("a"), '{"op": "add", "row": {"id": "c", "nom'])
+
+    journal = bot2.WriteJournal(str(path))
+    assert [p["id"] for p in journal.load()] == ["b"]
+    # Jurnal ditulis ulang hanya berisi entri yang belum di-ack, tanpa baris rusak
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["row"]["id"] for line in lines] == ["b"]
+
+
+def test_journal_duplicate_ack_after_crash(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [add_line("a"), ack_line("a"), ack_line("a"), add_line("b")])
+
+    journal = bot2.WriteJournal(str(path))
+    assert [p["id"] for p in journal.load()] == ["b"]
+    journal.ack(["b"])
+    journal.ack(["b"])
+    journal.close()
+    assert bot2.WriteJournal(str(path)).load() == []
+
+
+# ===== WriteQueue =====
+def test_replayed_rows_already_saved_are_acked(tmp_path, sync, replies):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [add_line("a", 5000)])
+    journal = bot2.WriteJournal(str(path))
+    queue = bot2.WriteQueue(journal, 50, 0, 0)
+    queue.restore()
+    assert month_total(sync) == 5000
+
+    # Baris sudah tersimpan sebelum crash: Apps Script melewatinya sebagai duplikat
+    replies.append({"saved": 0, "duplicates": 1})
+    asyncio.run(queue.flush())
+    assert len(queue) == 0
+    assert journal.load() == []
+    assert month_total(sync) == 5000
+
+
+@pytest.mark.parametrize("reply", [
+    httpx.Response(200, text="<html>Exception: Lock timeout</html>"),
+    {"saved": 1, "duplicates": 0},
+    httpx.Response(200, text="Catatan dengan deskripsi : ..."),
+])
+def test_unconfirmed_batch_stays_in_journal(tmp_path, sync, replies, reply):
+    journal = bot2.WriteJournal(str(tmp_path / "journal.jsonl"))
+    queue = bot2.WriteQueue(journal, 50, 0, 0)
+
+    async def scenario():
+        for nominal in (1000, 2000):
+            await queue.submit(payload(nominal), bot2.expense_from_payload(payload(nominal)))
+        replies.append(reply)
+        with pytest.raises(bot2.WriteNotConfirmed):
+            await queue.flush()
+
+    asyncio.run(scenario())
+    assert len(queue) == 2
+    journal.close()
+    assert len(bot2.WriteJournal(str(tmp_path / "journal.jsonl")).load()) == 2
+
+
+def test_sender_survives_unexpected_errors(tmp_path, sync, replies):
+    journal = bot2.WriteJournal(str(tmp_path / "journal.jsonl"))
+    queue = bot2.WriteQueue(journal, 50, 0, 0)
+
+    async def scenario():
+        queue.start()
+        await queue.submit(payload(1000), bot2.expense_from_payload(payload(1000)))
+        replies.extend([RuntimeError("boom"), {"saved": 1, "duplicates": 0}])
+        for _ in range(100):
+            if not len(queue):
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert len(queue) == 0
+    assert journal.load() == []
+
+
+# ===== Pending writes and delta sync =====
+def test_delta_after_confirmed_write_counts_once(sync, replies):
+    replies.append({"full": True, "cursor": 1, "token": "t1", "rows": [row("01-03-2025", 1000)]})
+    asyncio.run(sync.pull())
+
+    record = bot2.expense_from_payload(payload(2000))
+    sync.record_write(record, confirmed=False)
+    sync.confirm_writes([record])
+    assert month_total(sync) == 3000
+
+    replies.append({"full": False, "cursor": 2, "token": "t2", "rows": [row("01-03-2025", 2000)]})
+    records = asyncio.run(sync.pull())
+    assert len(records) == 2
+    assert month_total(sync) == 3000
+    assert sync.total == 3000
+
+
+def test_queued_write_is_not_settled_by_delta(sync, replies):
+    replies.append({"full": True, "cursor": 1, "token": "t1", "rows": [row("01-03-2025", 1000)]})
+    asyncio.run(sync.pull())
+
+    sync.record_write(bot2.expense_from_payload(payload(2000)), confirmed=False)
+    replies.append({"full": False, "cursor": 1, "token": "t1", "rows": []})
+    asyncio.run(sync.pull())
+    assert month_total(sync) == 3000
+
+
+def test_write_confirmed_during_pull_waits_for_next_sync(sync, replies):
+    replies.append({"full": True, "cursor": 1, "token": "t1", "rows": [row("01-03-2025", 1000)]})
+    asyncio.run(sync.pull())
+
+    record = bot2.expense_from_payload(payload(2000))
+    sync.record_write(record, confirmed=False)
+
+    def confirm_mid_request():
+        # Write selesai setelah getData dibaca server: balasannya belum memuat baris itu
+        sync.confirm_writes([record])
+        return {"full": False, "cursor": 1, "token": "t1", "rows": []}
+
+    replies.append(confirm_mid_request)
+    asyncio.run(sync.pull())
+    assert month_total(sync) == 3000
+
+    replies.append({"full": False, "cursor": 2, "token": "t2", "rows": [row("01-03-2025", 2000)]})
+    asyncio.run(sync.pull())
+    assert month_total(sync) == 3000
+
+
+def test_full_resync_keeps_pending_writes(sync, replies):
+    replies.append({"full": True, "cursor": 1, "token": "t1", "rows": [row("01-03-2025", 1000)]})
+    asyncio.run(sync.pull())
+    generation = sync.generation
+
+    sync.record_write(bot2.expense_from_payload(payload(2000)), confirmed=False)
+    replies.append({"full": True, "cursor": 1, "token": "t9", "rows": [row("01-03-2025", 1500)]})
+    records = asyncio.run(sync.pull())
+    assert records.generation == generation + 1
+    assert month_total(sync) == 3500